@@ -0,0 +1,85 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+import metrics
+
+# 外部服務的用戶端在第一次使用時才匯入與建立，縮短冷啟動時間
+GEMINI_MODEL = 'gemini-2.0-flash-exp'
+
+# LINE API 呼叫的耗時，依方法與 HTTP 狀態碼分類
+LINE_API_SECONDS = metrics.histogram('linebot_line_api_seconds', 'LINE Messaging API 呼叫耗時（秒）', ('method', 'status'))
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _get_or_create(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+
+def _create_line_bot_api():
+    from linebot import LineBotApi
+    # LINE_API_ENDPOINT 可指向本機的替身伺服器（壓力測試用）
+    endpoint = os.getenv('LINE_API_ENDPOINT')
+    options = {'endpoint': endpoint} if endpoint else {}
+    return LineBotApi(os.getenv('LINE_CHANNEL_ACCESS_TOKEN'), **options)
+
+
+def _create_webhook_parser():
+    from linebot import WebhookParser
+    return WebhookParser(os.getenv('LINE_CHANNEL_SECRET'))
+
+
+def _create_gemini_model():
+    import google.generativeai as generativeai
+    # 設置 Google Generative AI API 密鑰
+    # GEMINI_API_ENDPOINT 可指向本機的替身伺服器（壓力測試用，需使用 REST 傳輸）
+    endpoint = os.getenv('GEMINI_API_ENDPOINT')
+    options = {'transport': 'rest', 'client_options': {'api_endpoint': endpoint}} if endpoint else {}
+    generativeai.configure(api_key=os.getenv('KEY'), **options)
+    return generativeai.GenerativeModel(GEMINI_MODEL)
+
+
+def get_line_bot_api():
+    return _get_or_create('line_bot_api', _create_line_bot_api)
+
+
+def get_webhook_parser():
+    return _get_or_create('webhook_parser', _create_webhook_parser)
+
+
+def get_gemini_model():
+    return _get_or_create('gemini_model', _create_gemini_model)
+
+
+# 預先建立所有用戶端，避免第一個請求負擔匯入時間
+def warm_up():
+    for name, getter in (('LINE', get_line_bot_api), ('Webhook', get_webhook_parser), ('Gemini', get_gemini_model)):
+        try:
+            getter()
+        except Exception as e:
+            logging.error(f"預先建立 {name} 用戶端時發生錯誤：{str(e)}")
+    logging.info("外部服務用戶端已預先建立")
+
+
+@contextmanager
+def line_api_call(method):
+    # 失敗時以 LineBotApiError 的狀態碼分類，連線錯誤等記為 error
+    start = time.perf_counter()
+    status = '200'
+    try:
+        yield
+    except Exception as e:
+        status = str(getattr(e, 'status_code', None) or 'error')
+        raise
+    finally:
+        LINE_API_SECONDS.observe(time.perf_counter() - start, method, status)
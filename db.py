@@ -0,0 +1,330 @@
+import os
+import sqlite3
+import functools
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+import metrics
+
+# 資料庫文件路徑
+DB_PATH = os.path.join(os.getcwd(), 'data', 'ingredients.db')
+
+# 每個連線快取的預備語句數量（sqlite3 依 SQL 字串重複使用已編譯的語句）
+STATEMENT_CACHE_SIZE = 256
+
+# 每個連線建立時套用的 PRAGMA 設定
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',      # 讀取不會被寫入阻塞
+    'PRAGMA synchronous = NORMAL',    # WAL 模式下安全且減少 fsync
+    'PRAGMA busy_timeout = 5000',     # 寫入鎖競爭時等待而不是立即失敗
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -8000',      # 約 8MB 頁面快取
+    'PRAGMA foreign_keys = ON',
+)
+
+# 各資料庫輔助函數（get_ingredient_page、add_ingredients 等）整個呼叫的執行時間，由 timed() 記錄
+QUERY_SECONDS = metrics.histogram('linebot_db_query_seconds', 'SQLite 輔助函數耗時（秒），依輔助函數分類', ('helper',))
+
+# 每個執行緒持有一個長期連線
+_local = threading.local()
+# 每次 configure / close_all 都會遞增，讓各執行緒在下次使用時重新連線
+_generation = 0
+_generation_lock = threading.Lock()
+# 依資料庫內容建立的記憶體快取（列表頁、到期堆積等），切換資料庫時清除
+_configure_callbacks = []
+
+
+def on_configure(func):
+    # 裝飾器：註冊切換資料庫時要呼叫的清除函數
+    _configure_callbacks.append(func)
+    return func
+
+
+def configure(path):
+    # 切換資料庫路徑，既有的執行緒連線會在下次使用時重新建立；舊資料庫的快取版本號對新資料庫無意義
+    global DB_PATH
+    DB_PATH = path
+    close_all()
+    for callback in _configure_callbacks:
+        callback()
+
+
+def close_all():
+    global _generation
+    with _generation_lock:
+        _generation += 1
+    close_connection()
+
+
+def close_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"關閉資料庫連線時發生錯誤：{str(e)}")
+    _local.conn = None
+
+
+def _connect():
+    # isolation_level=None：由 transaction() 明確控制交易，單一讀取不會持有快照
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'generation', None) != _generation:
+        close_connection()
+        conn = _connect()
+        _local.conn = conn
+        _local.generation = _generation
+    return conn
+
+
+# 裝飾器：以輔助函數的名稱為標籤記錄耗時，包含其中所有的查詢與交易
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with QUERY_SECONDS.time(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def transaction():
+    # BEGIN IMMEDIATE 一開始就取得寫入鎖，避免讀轉寫時的死結；巢狀呼叫共用外層交易
+    conn = get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    else:
+        conn.execute('COMMIT')
+
+
+def query_all(sql, params=()):
+    return get_connection().execute(sql, params).fetchall()
+
+
+def query_one(sql, params=()):
+    return get_connection().execute(sql, params).fetchone()
+
+
+def execute(sql, params=()):
+    # 單一語句在自動提交模式下執行，回傳受影響的列數
+    return get_connection().execute(sql, params).rowcount
+
+
+def executemany(sql, seq_of_params):
+    with transaction() as conn:
+        return conn.executemany(sql, seq_of_params).rowcount
+
+
+# 日期以 ISO 格式（YYYY-MM-DD）儲存，字串排序即日期排序，可使用索引範圍查詢
+DISPLAY_DATE_FORMAT = '%Y/%m/%d'
+
+
+def to_db_date(date_text):
+    # 接受使用者輸入的 YYYY/MM/DD（允許不補零，例如 2025/1/5）
+    return datetime.strptime(date_text.strip(), DISPLAY_DATE_FORMAT).date().isoformat()
+
+
+def to_display_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime(DISPLAY_DATE_FORMAT)
+    except ValueError:
+        # 遷移時無法轉換的舊資料，原樣顯示
+        return value
+
+
+# 資料庫結構遷移，依序執行並以 PRAGMA user_version 記錄已套用的版本
+def _create_base_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ingredients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            expiration_date TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY
+        )
+    ''')
+
+
+def _normalize_expiration_dates(conn):
+    # 舊資料為 YYYY/MM/DD 自由文字，轉成 ISO 日期並建立索引
+    rows = conn.execute("SELECT id, expiration_date FROM ingredients WHERE expiration_date LIKE '%/%'").fetchall()
+    updates = []
+    for ingredient_id, value in rows:
+        try:
+            updates.append((to_db_date(value), ingredient_id))
+        except ValueError:
+            logging.warning(f"無法轉換的有效日期，保留原值：ID {ingredient_id} {value}")
+    conn.executemany('UPDATE ingredients SET expiration_date = ? WHERE id = ?', updates)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ingredients_expiration ON ingredients (expiration_date)')
+
+
+def _create_recipe_cache(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS recipe_cache (
+            ingredients_key TEXT PRIMARY KEY,
+            recipe TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_recipe_cache_created ON recipe_cache (created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_recipe_cache_last_used ON recipe_cache (last_used_at)')
+
+
+def _add_ingredient_owner(conn):
+    # 食材歸屬於 LINE 用戶、群組或聊天室 ID
+    conn.execute("ALTER TABLE ingredients ADD COLUMN owner_id TEXT NOT NULL DEFAULT ''")
+    # 舊資料沒有歸屬；只有一位用戶時可以確定是誰的
+    users = conn.execute('SELECT user_id FROM users LIMIT 2').fetchall()
+    if len(users) == 1:
+        conn.execute("UPDATE ingredients SET owner_id = ? WHERE owner_id = ''", (users[0][0],))
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ingredients_owner_expiration ON ingredients (owner_id, expiration_date)')
+
+
+def _create_sessions(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            record TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (updated_at)')
+
+
+def _create_scheduler_tables(conn):
+    # 每個擁有者的提醒時間（HH:MM），未設定者使用預設時間
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reminder_settings (
+            owner_id TEXT PRIMARY KEY,
+            reminder_time TEXT NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_reminder_settings_time ON reminder_settings (reminder_time)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scheduler_runs (
+            job TEXT PRIMARY KEY,
+            last_run_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+
+
+def _create_reminder_ledger(conn):
+    # notify_on：下一個提醒門檻被跨過的日期；notified_threshold：已通知過的最小門檻天數
+    conn.execute('ALTER TABLE ingredients ADD COLUMN notify_on TEXT')
+    conn.execute('ALTER TABLE ingredients ADD COLUMN notified_threshold INTEGER')
+    # 既有食材以預設的最大門檻（到期前 3 天）起算，與 reminder.DEFAULT_THRESHOLDS 一致
+    conn.execute("UPDATE ingredients SET notify_on = date(expiration_date, '-3 days')")
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ingredients_notify_on ON ingredients (notify_on) WHERE notify_on IS NOT NULL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reminder_ledger (
+            ingredient_id INTEGER NOT NULL REFERENCES ingredients (id) ON DELETE CASCADE,
+            threshold INTEGER NOT NULL,
+            sent_at REAL NOT NULL,
+            PRIMARY KEY (ingredient_id, threshold)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reminder_thresholds (
+            owner_id TEXT PRIMARY KEY,
+            thresholds TEXT NOT NULL
+        )
+    ''')
+
+
+def _add_ingredient_name_index(conn):
+    # 「查詢 名稱」依名稱分頁
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ingredients_owner_name ON ingredients (owner_id, name)')
+
+
+def _create_inventory_versions(conn):
+    # 每次修改擁有者的食材都遞增版本，用來判斷已渲染的列表是否過期
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_versions (
+            owner_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    ''')
+
+
+def _create_name_grams(conn):
+    # 名稱搜尋的 n-gram 索引；刪除食材時由外鍵連帶刪除
+    import name_index
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS name_grams (
+            owner_id TEXT NOT NULL,
+            gram TEXT NOT NULL,
+            ingredient_id INTEGER NOT NULL REFERENCES ingredients(id) ON DELETE CASCADE,
+            PRIMARY KEY (owner_id, gram, ingredient_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_name_grams_ingredient ON name_grams (ingredient_id)')
+    name_index.rebuild(conn)
+
+
+def _create_webhook_events(conn):
+    # 多個 worker 共用的 webhookEventId 紀錄，用來略過 LINE 重新傳送的事件
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_events (
+            event_id TEXT PRIMARY KEY,
+            received_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_webhook_events_received_at ON webhook_events (received_at)')
+
+
+MIGRATIONS = (
+    _create_base_schema,
+    _normalize_expiration_dates,
+    _create_recipe_cache,
+    _add_ingredient_owner,
+    _create_sessions,
+    _create_scheduler_tables,
+    _create_reminder_ledger,
+    _add_ingredient_name_index,
+    _create_inventory_versions,
+    _create_name_grams,
+    _create_webhook_events,
+)
+
+
+def migrate():
+    # 已是最新版本時不取得寫入鎖，多個 worker 同時啟動也只需一次讀取
+    version = query_one('PRAGMA user_version')[0]
+    while version < len(MIGRATIONS):
+        # BEGIN IMMEDIATE 取得資料庫檔案的寫入鎖，鎖內重新讀取版本，確保每個遷移只執行一次
+        with transaction() as conn:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version >= len(MIGRATIONS):
+                break
+            MIGRATIONS[version](conn)
+            version += 1
+            conn.execute(f'PRAGMA user_version = {version}')
+        logging.info(f"資料庫結構已更新至版本 {version}")
+    return version
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import random
+import logging
+import tempfile
+import statistics
+from datetime import date, timedelta
+import db
+import name_index
+import reminder
+
+# 每次寫入多少列，產生百萬列資料時避免單一交易過大
+GENERATE_CHUNK = 10000
+# 到期日分佈在今天前後的天數範圍，約有 1% 的食材今天需要提醒
+EXPIRATION_RANGE = (-30, 365)
+# 隨機挑選食材時最多嘗試幾個擁有者，之後改取任一剩餘的食材
+PICK_ATTEMPTS = 20
+
+
+# 產生 users 與 ingredients：擁有者平均分配，到期日隨機分佈
+def generate(rows, rows_per_owner=50, seed=0):
+    rng = random.Random(seed)
+    owners = [f"U{index:032x}" for index in range(max(1, rows // rows_per_owner))]
+    today = date.today()
+    with db.transaction() as conn:
+        conn.executemany('INSERT OR IGNORE INTO users (user_id) VALUES (?)', [(owner_id,) for owner_id in owners])
+    for offset in range(0, rows, GENERATE_CHUNK):
+        chunk = []
+        for index in range(offset, min(rows, offset + GENERATE_CHUNK)):
+            expiration_date = (today + timedelta(days=rng.randint(*EXPIRATION_RANGE))).isoformat()
+            chunk.append((rng.choice(owners), f"食材{index}", expiration_date,
+                          reminder.next_notify_on(expiration_date, reminder.DEFAULT_THRESHOLDS)))
+        with db.transaction() as conn:
+            conn.executemany('INSERT INTO ingredients (owner_id, name, expiration_date, notify_on) VALUES (?, ?, ?, ?)', chunk)
+    with db.transaction() as conn:
+        name_index.rebuild(conn)
+    db.execute('ANALYZE')
+    return owners
+
+
+def measure(func, rounds, setup=None):
+    timings = []
+    for round_index in range(rounds):
+        args = setup(round_index) if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "rounds": rounds,
+        "min_ms": min(timings),
+        "median_ms": statistics.median(timings),
+        "mean_ms": statistics.fmean(timings),
+        "max_ms": max(timings),
+    }
+
+
+def _random_ingredient(rng, owners):
+    # 隨機挑一個擁有者底下的食材；擁有者的食材被刪光時換一個，多次找不到就取任一剩餘的食材
+    for attempt in range(PICK_ATTEMPTS):
+        owner_id = rng.choice(owners)
+        row = db.query_one('SELECT id FROM ingredients WHERE owner_id = ? ORDER BY id LIMIT 1 OFFSET ?', (owner_id, rng.randint(0, 9)))
+        if row:
+            return owner_id, row[0]
+    row = db.query_one('SELECT owner_id, id FROM ingredients ORDER BY id LIMIT 1')
+    if row is None:
+        raise RuntimeError("沒有剩餘的食材可供量測")
+    return row
+
+
+def bench_size(app_module, rows, rounds, rows_per_owner=50, seed=0):
+    rng = random.Random(seed)
+    owners = generate(rows, rows_per_owner, seed)
+    results = {}
+
+    results["get_ingredient_page"] = measure(
+        app_module.get_ingredient_page, rounds,
+        lambda i: (rng.choice(owners), "expiration", None, 11))
+    results["get_ingredient_page_by_name"] = measure(
+        app_module.get_ingredient_page, rounds,
+        lambda i: (rng.choice(owners), "name", ["食材", 0], 11))
+    results["search_ingredients"] = measure(
+        name_index.search, rounds,
+        lambda i: (rng.choice(owners), f"食材{rng.randrange(rows)}"))
+    # 刪除最多用掉一半的資料，列數比回合數少時仍留下食材給後面的修改
+    results["delete_ingredient"] = measure(
+        app_module.delete_ingredient, max(1, min(rounds, rows // 2)),
+        lambda i: _random_ingredient(rng, owners))
+    results["modify_ingredient_name"] = measure(
+        lambda owner_id, ingredient_id: app_module.modify_ingredient(owner_id, ingredient_id, new_name="改名"), rounds,
+        lambda i: _random_ingredient(rng, owners))
+    results["modify_ingredient_date"] = measure(
+        lambda owner_id, ingredient_id: app_module.modify_ingredient(owner_id, ingredient_id, new_expiration_date="2099/01/01"), rounds,
+        lambda i: _random_ingredient(rng, owners))
+
+    # 不連線 LINE：以只計數的 dispatch 取代實際發送，量測查詢、寫入通知紀錄與組合訊息
+    due = db.query_all('SELECT id, notified_threshold, notify_on FROM ingredients WHERE notify_on <= ?', (date.today().isoformat(),))
+
+    def reset_reminders(round_index):
+        with db.transaction() as conn:
+            conn.execute('DELETE FROM reminder_ledger')
+            conn.executemany('UPDATE ingredients SET notified_threshold = ?, notify_on = ? WHERE id = ?',
+                             [(notified, notify_on, ingredient_id) for ingredient_id, notified, notify_on in due])
+        return ()
+
+    original_dispatch = reminder.dispatch
+    reminder.dispatch = lambda sends: (sum(len(recipients) for recipients, text in sends), [])
+    try:
+        results["send_reminders"] = measure(reminder.send_reminders, max(1, rounds // 10), reset_reminders)
+    finally:
+        reminder.dispatch = original_dispatch
+    results["send_reminders"]["due_rows"] = len(due)
+    return results
+
+
+def benchmark(app_module, sizes, rounds=50, rows_per_owner=50):
+    report = {"sizes": {}}
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db.configure(os.path.join(tmp, 'benchmark.db'))
+            db.migrate()
+            started = time.perf_counter()
+            report["sizes"][str(rows)] = bench_size(app_module, rows, rounds, rows_per_owner)
+            print(f"{rows} 列的基準測試完成，耗時 {time.perf_counter() - started:.1f} 秒")
+            db.close_all()
+    return report
+
+
+# 與基準結果比較中位數：超過門檻比例且差距大於 min_delta_ms 才算退步
+def compare(report, baseline, threshold, min_delta_ms):
+    regressions = []
+    for rows, results in report["sizes"].items():
+        for name, result in results.items():
+            previous = baseline.get("sizes", {}).get(rows, {}).get(name)
+            if previous is None:
+                continue
+            delta = result["median_ms"] - previous["median_ms"]
+            if delta > min_delta_ms and result["median_ms"] > previous["median_ms"] * (1 + threshold):
+                regressions.append(f"{name} @ {rows} 列：{previous['median_ms']:.2f} ms → {result['median_ms']:.2f} ms")
+    return regressions
+
+
+def format_report(report):
+    lines = [f"{'列數':<10}{'函數':<30}{'中位數 ms':>12}{'最小 ms':>12}{'最大 ms':>12}"]
+    for rows, results in report["sizes"].items():
+        for name, result in results.items():
+            lines.append(f"{rows:<12}{name:<32}{result['median_ms']:>12.3f}{result['min_ms']:>12.3f}{result['max_ms']:>12.3f}")
+    return "\n".join(lines)
+
+
+# CLI 子命令：依序產生各種規模的資料並量測，可寫入 JSON，與基準比較退步時以狀態碼 1 結束
+def run(args, app_module):
+    logging.getLogger().setLevel(logging.WARNING)
+    sizes = [int(float(size)) for size in args.rows.split(',')]
+    report = benchmark(app_module, sizes, rounds=args.rounds, rows_per_owner=args.rows_per_owner)
+    print(format_report(report))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.threshold, args.min_delta_ms)
+        if regressions:
+            print("效能退步：\n" + "\n".join(regressions))
+            return 1
+    return 0
@@ -0,0 +1,74 @@
+import os
+import time
+import logging
+import db
+from expiring_map import ExpiringMap, SweepCounter
+
+# LINE 重新傳送 Webhook 時 webhookEventId 不變；在這段時間（秒）內看過的事件視為重複
+DEFAULT_WINDOW = 60 * 60
+# 記憶體中最多記錄的事件數
+DEFAULT_MAX_EVENTS = 100000
+# SQLite 後端每寫入幾次就清理一次過期資料
+SWEEP_INTERVAL = 500
+
+
+# 單一程序內的已處理事件：依收到時間排序，超過時間窗或數量上限時淘汰最舊的
+class MemoryDeduplicator:
+    def __init__(self, window=DEFAULT_WINDOW, max_events=DEFAULT_MAX_EVENTS):
+        self.window = window
+        self.max_events = max_events
+        self._seen = ExpiringMap(window, max_events)
+
+    def seen(self, event_id):
+        # 第一次看到時記錄並回傳 False，重複時回傳 True
+        return not self._seen.add(event_id, True, time.time())
+
+    def forget(self, event_id):
+        # 事件沒有被接受（例如佇列已滿回應 503）時撤銷，LINE 重新傳送時才會處理
+        self._seen.pop(event_id)
+
+    def __len__(self):
+        return len(self._seen)
+
+
+# 多個 worker 共用：先查本機記憶體，沒看過才以 SQLite 主鍵判斷其他 worker 是否已處理
+class SQLiteDeduplicator:
+    def __init__(self, window=DEFAULT_WINDOW, max_events=DEFAULT_MAX_EVENTS):
+        self.window = window
+        self.local = MemoryDeduplicator(window, max_events)
+        self._sweeper = SweepCounter(SWEEP_INTERVAL, self.sweep)
+
+    @db.timed('dedupe_seen')
+    def seen(self, event_id):
+        if self.local.seen(event_id):
+            return True
+        now = time.time()
+        # 已存在且仍在時間窗內時不更新，受影響列數為 0 即表示重複
+        inserted = db.execute('''
+            INSERT INTO webhook_events (event_id, received_at) VALUES (?, ?)
+            ON CONFLICT(event_id) DO UPDATE SET received_at = excluded.received_at WHERE received_at <= ?
+        ''', (event_id, now, now - self.window))
+        self._sweeper.tick()
+        return inserted == 0
+
+    @db.timed('dedupe_forget')
+    def forget(self, event_id):
+        self.local.forget(event_id)
+        db.execute('DELETE FROM webhook_events WHERE event_id = ?', (event_id,))
+
+    @db.timed('sweep_webhook_events')
+    def sweep(self):
+        try:
+            db.execute('DELETE FROM webhook_events WHERE received_at <= ?', (time.time() - self.window,))
+        except Exception as e:
+            logging.error(f"清理 Webhook 事件紀錄時發生錯誤：{str(e)}")
+
+
+# 依環境變數 DEDUPE_BACKEND（memory 或 sqlite）建立重複事件過濾器
+def create_deduplicator():
+    backend = (os.getenv('DEDUPE_BACKEND') or 'memory').lower()
+    window = int(os.getenv('DEDUPE_WINDOW') or DEFAULT_WINDOW)
+    max_events = int(os.getenv('DEDUPE_MAX_EVENTS') or DEFAULT_MAX_EVENTS)
+    if backend == 'sqlite':
+        return SQLiteDeduplicator(window=window, max_events=max_events)
+    return MemoryDeduplicator(window=window, max_events=max_events)
@@ -0,0 +1,74 @@
+import os
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# 背景處理 Webhook 事件的預設執行緒數量與等待處理的事件總數上限
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 1000
+
+
+# 依 key（用戶 ID）分組：同一個 key 的事件依序處理，不同 key 共用執行緒池並行處理，
+# 某個用戶的慢請求只會延遲他自己後面的事件，不會擋住分到同一個執行緒的其他用戶
+class EventDispatcher:
+    def __init__(self, workers=None, queue_size=None):
+        # 未指定時讀取環境變數 WEBHOOK_WORKERS / WEBHOOK_QUEUE_SIZE
+        self.workers = max(1, workers or int(os.getenv('WEBHOOK_WORKERS') or DEFAULT_WORKERS))
+        self.queue_size = queue_size or int(os.getenv('WEBHOOK_QUEUE_SIZE') or DEFAULT_QUEUE_SIZE)
+        # 有事件等待或正在處理的 key → 尚未開始的事件
+        self._pending = {}
+        self._size = 0
+        self._condition = threading.Condition()
+        self._executor = None
+
+    def start(self):
+        # 延後到第一次使用時才建立執行緒池，pre-fork 伺服器 fork 之後每個 worker 各自建立
+        with self._condition:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='webhook-worker')
+                logging.info(f"Webhook 工作執行緒池已建立：{self.workers} 個")
+
+    def submit(self, key, func, *args):
+        # 超過上限時不阻塞請求執行緒，回傳 False 由呼叫端決定如何回應
+        if self._executor is None:
+            self.start()
+        with self._condition:
+            if self._size >= self.queue_size:
+                return False
+            self._size += 1
+            pending = self._pending.get(key)
+            if pending is not None:
+                # 這個 key 已經在處理中，排在它後面即可
+                pending.append((func, args))
+                return True
+            self._pending[key] = deque([(func, args)])
+        self._executor.submit(self._run, key)
+        return True
+
+    def qsize(self):
+        return self._size
+
+    def join(self):
+        # 等待目前所有事件處理完畢（測試與關機時使用）
+        with self._condition:
+            while self._size:
+                self._condition.wait()
+
+    def _run(self, key):
+        # 每次只處理一個事件；同一個 key 還有事件時重新排到執行緒池的最後，讓其他 key 輪流使用
+        with self._condition:
+            func, args = self._pending[key].popleft()
+        try:
+            func(*args)
+        except Exception as e:
+            logging.error(f"處理 Webhook 事件時發生錯誤：{str(e)}")
+        finally:
+            with self._condition:
+                self._size -= 1
+                more = bool(self._pending[key])
+                if not more:
+                    del self._pending[key]
+                self._condition.notify_all()
+            if more:
+                self._executor.submit(self._run, key)
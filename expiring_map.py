@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+
+
+# 依最後寫入（或使用）時間排序的對應表：超過存活時間或總大小超過上限時從最舊的開始淘汰
+# weight 決定每個值佔用的大小，預設每筆為 1（即筆數上限）
+class ExpiringMap:
+    def __init__(self, ttl, capacity, weight=None):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.weight = weight or (lambda value: 1)
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, now, touch=False):
+        # 過期的項目視為不存在；touch 為 True 時更新使用時間並移到最後
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            if now - entry[1] > self.ttl:
+                self._remove(key)
+                return None
+            if touch:
+                self._items[key] = (entry[0], now)
+                self._items.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, now):
+        with self._lock:
+            self._put(key, value, now)
+
+    def add(self, key, value, now):
+        # 沒有未過期的同一個 key 時才寫入並回傳 True；檢查與寫入在同一個鎖內完成
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and now - entry[1] <= self.ttl:
+                return False
+            self._put(key, value, now)
+            return True
+
+    def pop(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _put(self, key, value, now):
+        self._remove(key)
+        self._items[key] = (value, now)
+        self._size += self.weight(value)
+        self._evict(now)
+
+    def _remove(self, key):
+        entry = self._items.pop(key, None)
+        if entry is not None:
+            self._size -= self.weight(entry[0])
+
+    def _evict(self, now):
+        # 最舊的在最前面，只需檢查開頭
+        while self._items:
+            key, (value, updated_at) = next(iter(self._items.items()))
+            if now - updated_at <= self.ttl and self._size <= self.capacity:
+                break
+            self._remove(key)
+
+
+# SQLite 後端的定期清理：每寫入 interval 次呼叫一次 sweep
+class SweepCounter:
+    def __init__(self, interval, sweep):
+        self.interval = interval
+        self.sweep = sweep
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def tick(self):
+        with self._lock:
+            self._writes += 1
+            due = self._writes % self.interval == 0
+        if due:
+            self.sweep()
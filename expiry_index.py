@@ -0,0 +1,101 @@
+import os
+import heapq
+import threading
+from collections import OrderedDict
+import db
+import view_cache
+
+# 每個擁有者一個以 (有效日期, ID) 排序的最小堆積，第一次使用時從 SQLite 載入
+# 最多保留的擁有者數（環境變數 EXPIRY_INDEX_OWNERS），超過時淘汰最久未使用的
+EXPIRY_INDEX_OWNERS = int(os.getenv('EXPIRY_INDEX_OWNERS') or 1024)
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+
+# 堆積中可能留有已刪除或已改期的項目（延遲刪除），以 live 判斷是否仍有效
+class _OwnerIndex:
+    def __init__(self, version, rows):
+        self.version = version
+        self.live = {ingredient_id: (expiration_date, name) for ingredient_id, name, expiration_date in rows}
+        self.heap = [(expiration_date, ingredient_id) for ingredient_id, (expiration_date, name) in self.live.items()]
+        heapq.heapify(self.heap)
+
+    def upsert(self, ingredient_id, name, expiration_date):
+        previous = self.live.get(ingredient_id)
+        self.live[ingredient_id] = (expiration_date, name)
+        if previous is None or previous[0] != expiration_date:
+            heapq.heappush(self.heap, (expiration_date, ingredient_id))
+
+    def delete(self, ingredient_id):
+        self.live.pop(ingredient_id, None)
+
+    def _valid(self, item, seen):
+        current = self.live.get(item[1])
+        return current is not None and current[0] == item[0] and item[1] not in seen
+
+    def top(self, k):
+        # 依序彈出 k 個有效項目再放回，O(k log n)；途中遇到的失效項目直接丟棄
+        result = []
+        seen = set()
+        while self.heap and len(result) < k:
+            item = heapq.heappop(self.heap)
+            if self._valid(item, seen):
+                seen.add(item[1])
+                result.append(item)
+        for item in result:
+            heapq.heappush(self.heap, item)
+        if len(self.heap) > 2 * len(self.live) + 16:
+            # 失效項目過多時重建，堆積大小維持在有效項目的常數倍
+            self.heap = [(expiration_date, ingredient_id) for ingredient_id, (expiration_date, name) in self.live.items()]
+            heapq.heapify(self.heap)
+        return [(ingredient_id, self.live[ingredient_id][1], expiration_date) for expiration_date, ingredient_id in result]
+
+
+@db.timed('load_expiry_index')
+def _load(owner_id, version):
+    rows = db.query_all('SELECT id, name, expiration_date FROM ingredients WHERE owner_id = ?', (owner_id,))
+    return _OwnerIndex(version, rows)
+
+
+# 回傳最早到期的 k 筆 (id, name, expiration_date)，順序與 ORDER BY expiration_date, id 相同
+# 庫存版本與載入時不同（例如其他 worker 寫入）時重新載入
+def top(owner_id, k):
+    version = view_cache.get_version(owner_id)
+    with _lock:
+        entry = _entries.get(owner_id)
+        if entry is not None and entry.version == version:
+            _entries.move_to_end(owner_id)
+            return entry.top(k)
+    entry = _load(owner_id, version)
+    with _lock:
+        current = _entries.get(owner_id)
+        # 載入期間其他執行緒已更新到更新的版本時保留較新的那一份
+        if current is None or current.version <= entry.version:
+            _entries[owner_id] = entry
+            _entries.move_to_end(owner_id)
+            while len(_entries) > EXPIRY_INDEX_OWNERS:
+                _entries.popitem(last=False)
+        return entry.top(k)
+
+
+# 寫入提交後呼叫：只有在記憶體中的版本正好是上一版時才逐筆套用，否則丟棄，下次使用時重新載入
+def apply(owner_id, version, upserts=(), deletes=()):
+    with _lock:
+        entry = _entries.get(owner_id)
+        if entry is None:
+            return
+        if entry.version != version - 1:
+            del _entries[owner_id]
+            return
+        for ingredient_id in deletes:
+            entry.delete(ingredient_id)
+        for ingredient_id, name, expiration_date in upserts:
+            entry.upsert(ingredient_id, name, expiration_date)
+        entry.version = version
+
+
+@db.on_configure
+def clear():
+    with _lock:
+        _entries.clear()
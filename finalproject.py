@@ -1,217 +1,568 @@
 import os
-import sqlite3
+import re
+import sys
+import time
+import argparse
 import logging
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
-from flask import Flask, request, abort
-from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
-from linebot.models import MessageEvent, TextMessage, TextSendMessage
-import google.generativeai as generativeai
-import schedule
-import time
-import threading
-from reminder import send_reminders  # 確保這個函數存在於你的 reminder.py 文件中
 
-# 載入環境變數
+# 載入環境變數（需在匯入會讀取環境變數的本地模組之前）
 load_dotenv()
 
-# 設置 Google Generative AI API 密鑰
-generativeai.configure(api_key=os.getenv('KEY'))
+from flask import Flask, Blueprint, Response, request, abort, jsonify, stream_with_context
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import clients
+import db
+import listing
+import expiry_index
+import log_setup
+import name_index
+import metrics
+import view_cache
+import reminder
+import scheduler
+import recipe_cache
+from dedupe import create_deduplicator
+from dispatcher import EventDispatcher
+from session_store import create_session_store, new_session
+
+# Flask 應用由 create_app() 建立；LINE 與 Gemini 用戶端在 clients 模組中延遲建立
+bp = Blueprint('linebot', __name__)
 
-# 初始化 Flask 應用和 LINE API
-app = Flask(__name__)
-line_bot_api = LineBotApi(os.getenv('LINE_CHANNEL_ACCESS_TOKEN'))
-handler = WebhookHandler(os.getenv('LINE_CHANNEL_SECRET'))
+# Webhook 事件交給背景工作執行緒處理，/callback 驗證簽章後立即回應
+dispatcher = EventDispatcher()
+
+# LINE 重新傳送的事件（相同 webhookEventId）在排入佇列前略過（DEDUPE_BACKEND=sqlite 時多個 worker 共用）
+deduplicator = create_deduplicator()
+
+# 指標：/metrics 以 Prometheus 文字格式輸出
+WEBHOOK_REQUESTS = metrics.counter('linebot_webhook_requests_total', 'Webhook 請求數', ('status',))
+WEBHOOK_DUPLICATES = metrics.counter('linebot_webhook_duplicate_events_total', '略過的重複 Webhook 事件數')
+WEBHOOK_ACK_SECONDS = metrics.histogram('linebot_webhook_ack_seconds', '/callback 驗證簽章並排入佇列的耗時（秒）')
+EVENT_SECONDS = metrics.histogram('linebot_event_seconds', '處理一則訊息的耗時（秒），依指令或對話狀態分類', ('command',))
+GEMINI_SECONDS = metrics.histogram('linebot_gemini_seconds', 'Gemini 產生食譜的耗時（秒）')
+GEMINI_ERRORS = metrics.counter('linebot_gemini_errors_total', 'Gemini 呼叫失敗次數', ('error',))
+metrics.gauge('linebot_webhook_queue_depth', '等待處理的 Webhook 事件數', lambda: dispatcher.qsize())
+metrics.gauge('linebot_recipe_cache', '食譜快取統計', lambda: recipe_cache.stats(), ('stat',))
+metrics.gauge('linebot_view_cache', '食材列表快取統計', lambda: view_cache.stats(), ('stat',))
 
 # 設置日誌
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# 用戶狀態管理
-user_states = {}
-
-# 資料庫文件路徑
-DB_PATH = os.path.join(os.getcwd(), 'data', 'ingredients.db')
+# 用戶狀態管理（SESSION_BACKEND=sqlite 時多個 worker 共用）
+sessions = create_session_store()
 
-# 初始化資料庫
+# 初始化資料庫：套用尚未執行的結構遷移，不會刪除既有資料
 def init_db():
     try:
-        if os.path.exists(DB_PATH):
-            logging.info(f"舊的資料庫檔案已刪除：{DB_PATH}")
-            os.remove(DB_PATH)
-
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ingredients (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                expiration_date TEXT NOT NULL
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id TEXT PRIMARY KEY
-            )
-        ''')
-        conn.commit()
-        conn.close()
-        logging.info(f"已成功重新生成資料庫，路徑：{DB_PATH}")
+        os.makedirs(os.path.dirname(db.DB_PATH), exist_ok=True)
+        version = db.migrate()
+        logging.info(f"資料庫已就緒（版本 {version}），路徑：{db.DB_PATH}")
     except Exception as e:
         logging.error(f"資料庫初始化時發生錯誤：{str(e)}")
-init_db()
+        raise
 
-# 手動新增即將過期的食材
-def add_test_ingredients():
+# 手動新增即將過期的食材（只在以 --seed 啟動時執行）
+def add_test_ingredients(owner_id):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
         # 新增一個即將過期的食材
         expiration_date = (datetime.now() + timedelta(days=3)).strftime('%Y/%m/%d')
-        cursor.execute('INSERT INTO ingredients (name, expiration_date) VALUES (?, ?)', ('測試食材', expiration_date))
-        conn.commit()
-        conn.close()
-        logging.info("已成功新增測試食材")
+        if add_ingredient(owner_id, '測試食材', expiration_date):
+            logging.info("已成功新增測試食材")
     except Exception as e:
         logging.error(f"新增測試食材時發生錯誤：{str(e)}")
 
-add_test_ingredients()
+# 應用程式工廠：多個 worker 可同時啟動，例如 gunicorn -w 4 'finalproject:create_app()'
+def create_app(db_path=None):
+    # 日誌改由背景執行緒寫出，請求執行緒只排入佇列
+    log_setup.configure()
+    db_path = db_path or os.getenv('DB_PATH')
+    if db_path:
+        db.configure(db_path)
+    init_db()
+    app = Flask(__name__)
+    app.register_blueprint(bp)
+    # RUN_SCHEDULER=0 時不啟動提醒排程器
+    if os.getenv('RUN_SCHEDULER', '1').lower() not in ('0', 'false', 'no'):
+        start_reminder_scheduler()
+    # WARM_UP=1 時在背景預先建立外部服務用戶端
+    if os.getenv('WARM_UP', '').lower() in ('1', 'true', 'yes'):
+        threading.Thread(target=clients.warm_up, name='warm-up', daemon=True).start()
+    return app
+
+@bp.route("/metrics")
+def export_metrics():
+    return metrics.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+# 批次匯入／匯出需要 IMPORT_TOKEN（Authorization: Bearer ...），未設定時停用
+def require_import_token():
+    token = os.getenv('IMPORT_TOKEN')
+    if not token:
+        abort(404)
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8')):
+        abort(401)
 
-@app.route("/callback", methods=['POST'])
+@bp.route("/import/<owner_id>", methods=['POST'])
+def import_endpoint(owner_id):
+    require_import_token()
+    import inventory_io
+    fmt = request.args.get('format') or ('jsonl' if 'json' in (request.content_type or '') else 'csv')
+    if fmt not in inventory_io.FORMATS:
+        abort(400)
+    # 逐行讀取請求內容，不會把整個檔案載入記憶體
+    lines = inventory_io.decode_lines(request.stream)
+    return jsonify(inventory_io.import_inventory(owner_id, lines, fmt))
+
+@bp.route("/export/<owner_id>", methods=['GET'])
+def export_endpoint(owner_id):
+    require_import_token()
+    import inventory_io
+    fmt = request.args.get('format') or 'csv'
+    if fmt not in inventory_io.FORMATS:
+        abort(400)
+    return Response(stream_with_context(inventory_io.export_inventory(owner_id, fmt)), mimetype=inventory_io.CONTENT_TYPES[fmt])
+
+@bp.route("/callback", methods=['POST'])
 def callback():
+    start = time.perf_counter()
     signature = request.headers.get('X-Line-Signature')
     body = request.get_data(as_text=True)
-    logging.info(f"收到來自LINE的Webhook請求：{body}")
 
+    from linebot.exceptions import InvalidSignatureError
     try:
-        handler.handle(body, signature)
+        events = clients.get_webhook_parser().parse(body, signature)
     except InvalidSignatureError:
         logging.error("Invalid signature. Check your channel access token/channel secret.")
+        WEBHOOK_REQUESTS.inc('400')
         abort(400)
-    
+    # 不記錄原始內容（含用戶 ID 與訊息），只記錄大小與事件數
+    logging.info("收到 Webhook 請求", extra=log_setup.fields(sample=True, bytes=len(body), events=len(events)))
+
+    # 依來源分組：同一用戶的事件依序處理，不同用戶的事件並行處理
+    rejected = 0
+    for event in events:
+        event_id = getattr(event, 'webhook_event_id', None)
+        if event_id and deduplicator.seen(event_id):
+            WEBHOOK_DUPLICATES.inc()
+            continue
+        if not dispatcher.submit(event_key(event), dispatch_event, event):
+            rejected += 1
+            if event_id:
+                # 未處理的事件不記錄，LINE 重新傳送時才會處理
+                deduplicator.forget(event_id)
+    if rejected:
+        # 佇列已滿：回應 503 讓 LINE 之後重新傳送
+        logging.error(f"Webhook 佇列已滿，{rejected} 個事件未處理")
+        WEBHOOK_REQUESTS.inc('503')
+        abort(503)
+
+    WEBHOOK_REQUESTS.inc('200')
+    WEBHOOK_ACK_SECONDS.observe(time.perf_counter() - start)
     return 'OK'
 
-@handler.add(MessageEvent, message=TextMessage)
+# 事件排序與對話狀態以用戶為單位；沒有用戶 ID 的事件（例如未授權的群組事件）改用群組／聊天室 ID
+def event_key(event):
+    return getattr(event.source, 'user_id', None) or get_owner_id(event.source)
+
+# 依事件類型分派到處理函數
+def dispatch_event(event):
+    from linebot.models import MessageEvent, TextMessage
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+        start = time.perf_counter()
+        command = 'error'
+        try:
+            command = handle_message(event)
+        finally:
+            EVENT_SECONDS.observe(time.perf_counter() - start, command)
+
+# 指標的分類：指令本身，或是輸入時所在的對話狀態（標籤數量固定）
+PREFIX_COMMANDS = ("查詢", "搜尋", "即將過期", "提醒時間", "提醒天數")
+EXACT_COMMANDS = ("新增", "下一頁", "刪除", "修改", "食譜")
+
+def command_label(user_message, state):
+    for command in PREFIX_COMMANDS:
+        if user_message.startswith(command):
+            return command
+    if user_message in EXACT_COMMANDS:
+        return user_message
+    return state or "unknown"
+
 def handle_message(event):
-    user_id = event.source.user_id  # 獲取用戶 ID
-    logging.info(f"收到來自用戶 {user_id} 的訊息")
+    user_id = getattr(event.source, 'user_id', None)  # 獲取用戶 ID（群組事件可能沒有）
+    session_key = event_key(event)  # 沒有用戶 ID 時以群組／聊天室 ID 保存對話狀態
+    owner_id = get_owner_id(event.source)  # 食材歸屬：群組、聊天室或個人
     user_message = event.message.text.strip()
 
     # 將用戶 ID 存儲到資料庫中
     store_user_id(user_id)
 
-    if user_id not in user_states:
-        user_states[user_id] = {"state": None, "data": {}}
+    session = sessions.get(session_key)
+    if session is None or session["owner"] != owner_id:
+        # 第一次對話、閒置過久，或換到另一個群組／聊天室時重新開始
+        session = new_session(owner_id)
+    command = command_label(user_message, session["state"])
+    logging.info("收到訊息", extra=log_setup.fields(sample=True, user=user_id, owner=owner_id, command=command))
 
     # 處理不同的用戶命令
     if user_message == "新增":
-        user_states[user_id] = {"state": "add_name", "data": {}}
+        set_state(session, "add_name")
         reply = "請輸入要新增的食材名稱和有效日期：\n（例如：蘋果 2025/01/01）"
-    elif user_message == "查詢":
-        user_states[user_id] = {"state": None, "data": {}}
-        ingredients = get_all_ingredients()
-        if ingredients:
-            reply = "\n".join([f"{row[0]}. {row[1]} (有效日期：{row[2]})" for row in ingredients])
+    elif user_message.startswith("查詢"):
+        # 「查詢」依到期日排序，「查詢 名稱」依名稱排序
+        set_state(session, None)
+        sort = SORT_ALIASES.get(user_message[len("查詢"):].strip(), "expiration")
+        reply = show_first_page(session, sort) or "目前沒有任何食材記錄。"
+    elif user_message == "下一頁":
+        # 保留目前的狀態，例如在「修改」中翻頁後仍可輸入編號
+        reply = show_next_page(session) or "已經是最後一頁了。"
+    elif user_message.startswith("搜尋"):
+        # 搜尋結果的編號可直接用在「刪除」與「修改」
+        set_state(session, None)
+        query = user_message[len("搜尋"):].strip()
+        if query:
+            rows = name_index.search(owner_id, query, listing.PAGE_SIZE)
+            reply = show_rows(session, rows) if rows else f"找不到符合「{query}」的食材。"
         else:
-            reply = "目前沒有任何食材記錄。"
+            reply = "請輸入要搜尋的食材名稱（例如：搜尋 高麗菜）。"
+    elif user_message.startswith("即將過期"):
+        # 「即將過期」列出最早到期的 5 筆，「即將過期 10」列出 10 筆
+        set_state(session, None)
+        count = user_message[len("即將過期"):].strip()
+        if count and not count.isdigit():
+            reply = "請輸入要列出的筆數（例如：即將過期 5）。"
+        else:
+            rows = expiry_index.top(owner_id, min(max(1, int(count or EXPIRING_DEFAULT)), listing.PAGE_SIZE))
+            reply = show_rows(session, rows) if rows else "目前沒有任何食材記錄。"
     elif user_message == "刪除":
-        user_states[user_id] = {"state": "delete", "data": {}}
-        reply = "請輸入要刪除的食材ID："
+        set_state(session, "delete")
+        reply = "請輸入要刪除的食材ID或名稱："
     elif user_message == "修改":
-        ingredients = get_all_ingredients()
-        if ingredients:
-            user_states[user_id] = {"state": "modify_select_id", "data": {}}
-            reply = "請選擇要修改的食材ID：\n" + "\n".join([f"{row[0]}. {row[1]} (有效日期：{row[2]})" for row in ingredients])
+        page = show_first_page(session, "expiration")
+        if page:
+            set_state(session, "modify_select_id")
+            reply = ["請選擇要修改的食材ID或輸入名稱：", page]
         else:
             reply = "目前沒有任何食材記錄。"
+    elif user_message.startswith("提醒時間"):
+        set_state(session, None)
+        try:
+            reminder_time = scheduler.normalize_reminder_time(user_message[len("提醒時間"):])
+            scheduler.set_reminder_time(owner_id, reminder_time)
+            if reminder_scheduler is not None:
+                reminder_scheduler.reload()
+            reply = f"已將每日提醒時間設定為：{reminder_time}"
+        except ValueError:
+            reply = "請輸入提醒時間（例如：提醒時間 08:00）。"
+    elif user_message.startswith("提醒天數"):
+        set_state(session, None)
+        try:
+            thresholds = reminder.parse_thresholds(user_message[len("提醒天數"):])
+            reminder.set_thresholds(owner_id, thresholds)
+            reply = f"已設定在到期前 {'、'.join(map(str, thresholds))} 天提醒。"
+        except ValueError:
+            reply = f"請輸入 0 到 {reminder.MAX_THRESHOLD} 之間的提醒天數（例如：提醒天數 3,1,0）。"
     elif user_message == "食譜":
-        user_states[user_id] = {"state": "recipe", "data": {}}
+        set_state(session, "recipe")
         reply = "請輸入食材名稱（請用空白分隔）："
     else:
-        state = user_states[user_id]["state"]
+        state = session["state"]
         if state == "add_name":
-            ingredients = user_message.split(';')
-            errors = []
+            # 先驗證整則訊息，再以單一交易批次寫入所有有效的食材
+            items, errors = parse_ingredient_batch(user_message)
             successes = []
-            for ingredient in ingredients:
-                try:
-                    parts = ingredient.split()
-                    if len(parts) != 2:
-                        errors.append(f"格式錯誤：{ingredient}")
-                        continue
-                    name, expiration_date = parts
-                    if validate_date(expiration_date.strip()):
-                        add_ingredient(name.strip(), expiration_date.strip())
-                        successes.append(f"{name.strip()} {expiration_date.strip()}")
-                    else:
-                        errors.append(f"日期無效或過去日期：{expiration_date.strip()}")
-                except ValueError:
-                    errors.append(f"格式錯誤：{ingredient}")
+            if items:
+                if add_ingredients(owner_id, items):
+                    successes = [f"{name} {expiration_date}" for name, expiration_date in items]
+                else:
+                    errors += [f"儲存失敗：{name} {expiration_date}" for name, expiration_date in items]
             reply = ""
             if successes:
                 reply += "已成功新增：\n" + "\n".join(successes)
             if errors:
                 reply += "以下食材新增失敗：\n" + "\n".join(errors)
-            user_states[user_id] = {"state": None, "data": {}}
+            set_state(session, None)
         elif state == "delete":
+            text = user_message.strip()
             try:
-                ingredient_id = int(user_message.strip())
-                delete_ingredient(ingredient_id)
-                reply = f"已成功刪除食材，ID：{ingredient_id}"
+                display_ids = parse_id_list(text)
             except ValueError:
-                reply = "格式錯誤，請輸入正確的食材ID。"
-            user_states[user_id] = {"state": None, "data": {}}
+                display_ids = []
+                reply = f"一次最多只能選擇 {MAX_BULK_IDS} 項食材。"
+            if display_ids:
+                # 多個編號與範圍（例如 3 5 7-12）在同一個交易中刪除
+                found, missing = resolve_display_ids(session, display_ids)
+                deleted = set(delete_ingredients(owner_id, [ingredient_id for display_id, ingredient_id in found]))
+                succeeded = [display_id for display_id, ingredient_id in found if ingredient_id in deleted]
+                missing += [display_id for display_id, ingredient_id in found if ingredient_id not in deleted]
+                for display_id in succeeded:
+                    forget_display_id(session, display_id)
+                reply = summarize_ids("已成功刪除食材", succeeded, missing)
+                set_state(session, None)
+            elif display_ids is None:
+                # 輸入名稱：名稱完全相同時直接刪除，否則列出候選，保持在刪除狀態
+                match, candidates = match_by_name(session, text)
+                if match is not None:
+                    if delete_ingredient(owner_id, match[0]):
+                        reply = f"已成功刪除食材：{match[1]}"
+                    else:
+                        reply = f"找不到食材：{text}"
+                    set_state(session, None)
+                elif candidates:
+                    reply = ["找到符合的食材，請輸入要刪除的食材ID：", candidates]
+                else:
+                    reply = f"找不到食材：{text}"
+                    set_state(session, None)
         elif state == "modify_select_id":
+            text = user_message.strip()
+            ingredient_ids = []
             try:
-                ingredient_id = int(user_message.strip())
-                user_states[user_id] = {"state": "modify_select_field", "data": {"id": ingredient_id}}
-                reply = "請選擇要修改的欄位：\n1. 名稱\n2. 有效日期"
+                display_ids = parse_id_list(text)
             except ValueError:
-                reply = "格式錯誤，請輸入正確的食材ID。"
+                display_ids = []
+                reply = f"一次最多只能選擇 {MAX_BULK_IDS} 項食材。"
+            if display_ids:
+                found, missing = resolve_display_ids(session, display_ids)
+                ingredient_ids = [ingredient_id for display_id, ingredient_id in found]
+                reply = f"找不到食材，ID：{format_id_list(missing)}" if missing else None
+            elif display_ids is None:
+                match, candidates = match_by_name(session, text)
+                if match is not None:
+                    ingredient_ids = [match[0]]
+                elif candidates:
+                    reply = ["找到符合的食材，請選擇要修改的食材ID：", candidates]
+                else:
+                    reply = f"找不到食材：{text}"
+            if ingredient_ids:
+                # 選擇多項時，之後輸入的新名稱或有效日期會套用到所有選擇的食材
+                set_state(session, "modify_select_field", {"ids": ingredient_ids})
+                prompt = "請選擇要修改的欄位：\n1. 名稱\n2. 有效日期"
+                if len(ingredient_ids) > 1:
+                    prompt = f"已選擇 {len(ingredient_ids)} 項食材。" + prompt
+                reply = f"{reply}\n{prompt}" if reply else prompt
         elif state == "modify_select_field":
             if user_message == "1":
-                user_states[user_id]["state"] = "modify_name"
+                session["state"] = "modify_name"
                 reply = "請輸入新的名稱："
             elif user_message == "2":
-                user_states[user_id]["state"] = "modify_expiration_date"
+                session["state"] = "modify_expiration_date"
                 reply = "請輸入新的有效日期："
             else:
                 reply = "請輸入有效的選項（1 或 2）。"
         elif state == "modify_name":
-            ingredient_id = user_states[user_id]["data"]["id"]
-            modify_ingredient(ingredient_id, new_name=user_message.strip())
-            reply = f"已成功修改食材名稱為：{user_message.strip()}"
-            user_states[user_id] = {"state": None, "data": {}}
+            ingredient_ids = selected_ids(session)
+            updated = modify_ingredients(owner_id, ingredient_ids, new_name=user_message.strip())
+            reply = summarize_modified(f"已成功修改食材名稱為：{user_message.strip()}", ingredient_ids, updated)
+            set_state(session, None)
         elif state == "modify_expiration_date":
-            ingredient_id = user_states[user_id]["data"]["id"]
+            ingredient_ids = selected_ids(session)
             if validate_date(user_message.strip()):
-                modify_ingredient(ingredient_id, new_expiration_date=user_message.strip())
-                reply = f"已成功修改食材有效日期為：{user_message.strip()}"
+                updated = modify_ingredients(owner_id, ingredient_ids, new_expiration_date=user_message.strip())
+                reply = summarize_modified(f"已成功修改食材有效日期為：{user_message.strip()}", ingredient_ids, updated)
             else:
                 reply = "日期格式錯誤，請使用正確的格式（YYYY/MM/DD）。"
-            user_states[user_id] = {"state": None, "data": {}}
+            set_state(session, None)
         elif state == "recipe":
-            try:
-                model = generativeai.GenerativeModel('gemini-2.0-flash-exp')
-                response = model.generate_content(f"請用以下食材創建食譜: {user_message}")
-                reply = response.text
-            except Exception as e:
-                reply = f"AI 發生錯誤：{str(e)}"
+            # 相同的食材組合（不論順序、空白、重複）直接使用快取的食譜
+            reply = recipe_cache.get(user_message)
+            if reply is None:
+                try:
+                    reply = generate_recipe(user_message)
+                    recipe_cache.put(user_message, reply)
+                except FutureTimeoutError:
+                    GEMINI_ERRORS.inc('Timeout')
+                    reply = "AI 回應逾時，請稍後再試。"
+                except Exception as e:
+                    GEMINI_ERRORS.inc(type(e).__name__)
+                    reply = f"AI 發生錯誤：{str(e)}"
+        else:
+            reply = "無法識別指令。請試試看「新增」、「查詢」、「搜尋」、「即將過期」、「刪除」、「修改」、「下一頁」、「食譜」、「提醒時間」、「提醒天數」。"
+
+    sessions.set(session_key, session)
+
+    # 回覆可以是文字、訊息物件或多則訊息的列表
+    from linebot.models import TextSendMessage
+    messages = reply if isinstance(reply, list) else [reply]
+    with clients.line_api_call('reply'):
+        clients.get_line_bot_api().reply_message(
+            event.reply_token,
+            [TextSendMessage(text=message) if isinstance(message, str) else message for message in messages]
+        )
+    return command
+
+# Gemini 在獨立的執行緒池中呼叫，超過 GEMINI_TIMEOUT 秒就先回覆逾時，
+# 事件的工作執行緒可以繼續處理同一用戶後面的訊息
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT') or 20)
+gemini_executor = ThreadPoolExecutor(max_workers=int(os.getenv('GEMINI_WORKERS') or 4), thread_name_prefix='gemini')
+
+def _generate(prompt):
+    model = clients.get_gemini_model()
+    with GEMINI_SECONDS.time():
+        return model.generate_content(prompt).text
+
+def generate_recipe(ingredients):
+    future = gemini_executor.submit(_generate, f"請用以下食材創建食譜: {ingredients}")
+    try:
+        return future.result(timeout=GEMINI_TIMEOUT)
+    except FutureTimeoutError:
+        # 還在排隊的呼叫直接取消，不佔用配額；已經開始的呼叫完成後存入快取，使用者重試時可直接取得
+        if not future.cancel():
+            future.add_done_callback(lambda f: _cache_late_recipe(ingredients, f))
+        raise
+
+def _cache_late_recipe(ingredients, future):
+    if future.exception() is None:
+        recipe_cache.put(ingredients, future.result())
+
+# 對話狀態輔助函數：切換狀態時保留上一次列表的顯示編號對照
+def set_state(session, state, data=None):
+    session["state"] = state
+    session["data"] = data if data is not None else {}
+
+# 列表分頁顯示，編號跨頁連續；session 記錄目前這一頁的顯示編號對應的實際 ID，
+# 以及下一頁的游標（排序欄位的值與 ID），翻頁不需要 OFFSET
+def show_first_page(session, sort):
+    return _show_page(session, {"sort": sort, "after": None, "start": 1})
+
+def show_next_page(session):
+    page = session.get("page")
+    return _show_page(session, page) if page else None
+
+def _show_page(session, page):
+    # 庫存版本沒變時直接使用已渲染的頁面，不查詢食材也不重新排版
+    owner_id = session["owner"]
+    key = (owner_id, page["sort"], tuple(page["after"] or ()), page["start"], date.today())
+    version = view_cache.get_version(owner_id)
+    cached = view_cache.get(key, version)
+    if cached is None:
+        cached = _render_page(owner_id, page)
+        view_cache.put(key, version, cached)
+    ids, next_page, message = cached
+    session["view"] = {"start": page["start"], "ids": list(ids)} if ids else None
+    session["page"] = next_page
+    return message
+
+def _render_page(owner_id, page):
+    rows = get_ingredient_page(owner_id, page["sort"], page["after"], listing.PAGE_SIZE + 1)
+    has_next = len(rows) > listing.PAGE_SIZE
+    rows = rows[:listing.PAGE_SIZE]
+    if not rows:
+        return (), None, None
+    last = rows[-1]
+    sort_value = last[2] if page["sort"] == "expiration" else last[1]
+    next_page = {"sort": page["sort"], "after": [sort_value, last[0]], "start": page["start"] + len(rows)} if has_next else None
+    return tuple(row[0] for row in rows), next_page, listing.render_page(rows, page["start"], has_next, page["sort"])
+
+# 搜尋結果或名稱候選以列表顯示，編號從 1 開始，沒有下一頁
+def show_rows(session, rows):
+    session["view"] = {"start": 1, "ids": [row[0] for row in rows]}
+    session["page"] = None
+    return listing.render_page(rows, 1, False, "expiration")
+
+# 以名稱選擇食材：只有一筆名稱完全相同時回傳 (id, 名稱)；其他符合的結果（即使只有一筆）回傳候選列表，
+# 避免模糊比對直接刪除或修改到名稱不同的食材
+def match_by_name(session, text):
+    rows = name_index.search(session["owner"], text, listing.PAGE_SIZE)
+    exact = [row for row in rows if row[1] == text]
+    if len(exact) == 1:
+        return exact[0][:2], None
+    return None, show_rows(session, rows) if rows else None
+
+# 解析「3 5 7-12」格式的編號列表（空白、逗號或頓號分隔），不是編號列表時回傳 None
+ID_LIST_PATTERN = re.compile(r'^\d+(?:-\d+)?(?:[\s,，、]+\d+(?:-\d+)?)*$')
+ID_LIST_SEPARATOR = re.compile(r'[\s,，、]+')
+# 一次批次刪除或修改的上限
+MAX_BULK_IDS = 100
+
+def parse_id_list(text):
+    if not ID_LIST_PATTERN.match(text):
+        return None
+    display_ids = {}
+    for token in ID_LIST_SEPARATOR.split(text):
+        first, _, last = token.partition('-')
+        start, end = sorted((int(first), int(last or first)))
+        if end - start + 1 + len(display_ids) > MAX_BULK_IDS:
+            raise ValueError(f"超過 {MAX_BULK_IDS} 項")
+        display_ids.update(dict.fromkeys(range(start, end + 1)))
+    return list(display_ids)
+
+# 連續的編號合併為範圍，例如 [3, 5, 7, 8, 9] → 3、5、7-9
+def format_id_list(display_ids):
+    parts = []
+    for display_id in sorted(display_ids):
+        if parts and parts[-1][1] == display_id - 1:
+            parts[-1][1] = display_id
+        else:
+            parts.append([display_id, display_id])
+    return "、".join(str(first) if first == last else f"{first}-{last}" for first, last in parts)
+
+def summarize_ids(message, succeeded, missing):
+    lines = []
+    if succeeded:
+        lines.append(f"{message}，ID：{format_id_list(succeeded)}")
+    if missing:
+        lines.append(f"找不到食材，ID：{format_id_list(missing)}")
+    return "\n".join(lines)
+
+def summarize_modified(message, ingredient_ids, updated):
+    if not updated:
+        return "找不到要修改的食材，可能已被刪除。"
+    if len(ingredient_ids) == 1:
+        return message
+    failed = len(ingredient_ids) - len(updated)
+    return f"{message}（共 {len(updated)} 項）" + (f"\n{failed} 項食材已不存在，未修改。" if failed else "")
+
+# 修改流程選擇的食材 ID；相容舊版只記錄單一 id 的對話狀態
+def selected_ids(session):
+    data = session["data"]
+    return data.get("ids") or [data["id"]]
+
+def resolve_display_ids(session, display_ids):
+    found = []
+    missing = []
+    for display_id in display_ids:
+        ingredient_id = resolve_display_id(session, display_id)
+        if ingredient_id is None:
+            missing.append(display_id)
         else:
-            reply = "無法識別指令。請試試看「新增」、「查詢」、「刪除」、「修改」、「食譜」。"
+            found.append((display_id, ingredient_id))
+    return found, missing
 
-    line_bot_api.reply_message(
-        event.reply_token,
-        TextSendMessage(text=reply)
-    )
+def resolve_display_id(session, display_id):
+    view = session.get("view")
+    if not isinstance(view, dict):
+        # 尚未查看過列表時，編號依照「查詢」第一頁的順序
+        rows = get_ingredient_page(session["owner"], "expiration", None, listing.PAGE_SIZE)
+        view = {"start": 1, "ids": [row[0] for row in rows]}
+        session["view"] = view
+    index = display_id - view["start"]
+    if 0 <= index < len(view["ids"]):
+        return view["ids"][index]
+    return None
 
+def forget_display_id(session, display_id):
+    # 保留其他編號不變，使用者畫面上的列表在下次查詢前仍然有效
+    view = session["view"]
+    view["ids"][display_id - view["start"]] = None
+
+# 群組與聊天室中的食材由所有成員共用，一對一聊天則屬於該用戶
+def get_owner_id(source):
+    if source.type == 'group':
+        return source.group_id
+    if source.type == 'room':
+        return source.room_id
+    return source.user_id
+
+@db.timed('store_user_id')
 def store_user_id(user_id):
+    # 群組／聊天室事件可能沒有 userId（例如用戶未同意提供資料），不寫入 NULL
+    if not user_id:
+        return
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,))
-        conn.commit()
-        conn.close()
+        db.execute('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,))
     except Exception as e:
         logging.error(f"存儲用戶ID時發生錯誤：{str(e)}")
 
@@ -225,81 +576,228 @@ def validate_date(date_text):
     except ValueError:
         return False
 
-def get_all_ingredients():
+# 排序方式對應的欄位，(擁有者, 欄位) 皆有索引
+SORT_COLUMNS = {"expiration": "expiration_date", "name": "name"}
+SORT_ALIASES = {"": "expiration", "到期": "expiration", "到期日": "expiration", "日期": "expiration", "名稱": "name"}
+# 「即將過期」預設列出的筆數
+EXPIRING_DEFAULT = 5
+
+# Keyset 分頁：after 為上一頁最後一筆的 (排序欄位值, ID)
+@db.timed('get_ingredient_page')
+def get_ingredient_page(owner_id, sort="expiration", after=None, limit=listing.PAGE_SIZE):
+    column = SORT_COLUMNS[sort]
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT id, name, expiration_date FROM ingredients ORDER BY id')
-        rows = cursor.fetchall()
-        conn.close()
-        return rows
+        if after is None and sort == "expiration":
+            # 依到期日的第一頁直接取記憶體中到期堆積的前 limit 筆
+            return expiry_index.top(owner_id, limit)
+        if after is None:
+            return db.query_all(f'SELECT id, name, expiration_date FROM ingredients WHERE owner_id = ? ORDER BY {column}, id LIMIT ?', (owner_id, limit))
+        return db.query_all(f'SELECT id, name, expiration_date FROM ingredients WHERE owner_id = ? AND ({column}, id) > (?, ?) ORDER BY {column}, id LIMIT ?',
+                            (owner_id, after[0], after[1], limit))
     except Exception as e:
         logging.error(f"查詢資料庫時發生錯誤：{str(e)}")
         return []
 
-def add_ingredient(name, expiration_date):
+# 解析「名稱 日期;名稱 日期」格式，回傳有效的 (名稱, 日期) 與錯誤訊息
+def parse_ingredient_batch(text):
+    items = []
+    errors = []
+    for ingredient in text.split(';'):
+        parts = ingredient.split()
+        if len(parts) != 2:
+            errors.append(f"格式錯誤：{ingredient}")
+            continue
+        name, expiration_date = parts
+        if validate_date(expiration_date):
+            items.append((name, expiration_date))
+        else:
+            errors.append(f"日期無效或過去日期：{expiration_date}")
+    return items, errors
+
+def add_ingredient(owner_id, name, expiration_date):
+    return add_ingredients(owner_id, [(name, expiration_date)])
+
+# 批次新增：所有食材與名稱索引一次提交
+@db.timed('add_ingredients')
+def add_ingredients(owner_id, items):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO ingredients (name, expiration_date) VALUES (?, ?)', (name, expiration_date))
-        conn.commit()
-        conn.close()
+        thresholds = reminder.get_thresholds(owner_id)
+        rows = []
+        for name, expiration_date in items:
+            expiration_date = db.to_db_date(expiration_date)
+            rows.append((owner_id, name, expiration_date, reminder.next_notify_on(expiration_date, thresholds)))
+        with db.transaction() as conn:
+            # 逐列插入以取得 ID，與名稱索引在同一個交易中寫入
+            ids = [conn.execute('INSERT INTO ingredients (owner_id, name, expiration_date, notify_on) VALUES (?, ?, ?, ?)', row).lastrowid
+                   for row in rows]
+            name_index.index(conn, owner_id, [(ingredient_id, row[1]) for ingredient_id, row in zip(ids, rows)])
+            version = view_cache.bump_version(conn, owner_id)
+        expiry_index.apply(owner_id, version, upserts=[(ingredient_id, row[1], row[2]) for ingredient_id, row in zip(ids, rows)])
+        return True
     except Exception as e:
         logging.error(f"新增食材時發生錯誤：{str(e)}")
+        return False
+
+def delete_ingredient(owner_id, ingredient_id):
+    return bool(delete_ingredients(owner_id, [ingredient_id]))
+
+def _existing_ids(conn, owner_id, ingredient_ids):
+    placeholders = ','.join('?' * len(ingredient_ids))
+    rows = conn.execute(f'SELECT id FROM ingredients WHERE owner_id = ? AND id IN ({placeholders})', (owner_id, *ingredient_ids)).fetchall()
+    found = {row[0] for row in rows}
+    return [ingredient_id for ingredient_id in dict.fromkeys(ingredient_ids) if ingredient_id in found]
 
-def delete_ingredient(ingredient_id):
+# 批次刪除：一次 executemany、一次提交，回傳實際刪除的 ID
+@db.timed('delete_ingredients')
+def delete_ingredients(owner_id, ingredient_ids):
+    if not ingredient_ids:
+        return []
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM ingredients WHERE id = ?', (ingredient_id,))
-        conn.commit()
-
-        # 重新排列所有食材的 ID
-        cursor.execute('SELECT id FROM ingredients ORDER BY id')
-        rows = cursor.fetchall()
-        for new_id, (old_id,) in enumerate(rows, start=1):
-            cursor.execute('UPDATE ingredients SET id = ? WHERE id = ?', (new_id, old_id))
-        conn.commit()
-        conn.close()
-        logging.info(f"已成功刪除食材，ID：{ingredient_id}")
+        with db.transaction() as conn:
+            ids = _existing_ids(conn, owner_id, ingredient_ids)
+            if ids:
+                # 名稱索引由外鍵 ON DELETE CASCADE 一併刪除
+                conn.executemany('DELETE FROM ingredients WHERE id = ?', [(ingredient_id,) for ingredient_id in ids])
+                version = view_cache.bump_version(conn, owner_id)
+        if ids:
+            expiry_index.apply(owner_id, version, deletes=ids)
+            logging.info("已成功刪除食材", extra=log_setup.fields(owner=owner_id, count=len(ids)))
+        return ids
     except Exception as e:
         logging.error(f"刪除食材時發生錯誤：{str(e)}")
+        return []
+
+def modify_ingredient(owner_id, ingredient_id, new_name=None, new_expiration_date=None):
+    return bool(modify_ingredients(owner_id, [ingredient_id], new_name, new_expiration_date))
 
-def modify_ingredient(ingredient_id, new_name=None, new_expiration_date=None):
+# 批次修改：所有選擇的食材套用相同的新名稱或有效日期，一次提交，回傳實際修改的 ID
+@db.timed('modify_ingredients')
+def modify_ingredients(owner_id, ingredient_ids, new_name=None, new_expiration_date=None):
+    if not ingredient_ids or not (new_name or new_expiration_date):
+        return []
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        if new_name:
-            cursor.execute('UPDATE ingredients SET name = ? WHERE id = ?', (new_name, ingredient_id))
-        if new_expiration_date:
-            cursor.execute('UPDATE ingredients SET expiration_date = ? WHERE id = ?', (new_expiration_date, ingredient_id))
-        conn.commit()
-        conn.close()
+        with db.transaction() as conn:
+            ids = _existing_ids(conn, owner_id, ingredient_ids)
+            if not ids:
+                return []
+            if new_name:
+                conn.executemany('UPDATE ingredients SET name = ? WHERE id = ?', [(new_name, ingredient_id) for ingredient_id in ids])
+                name_index.reindex(conn, owner_id, [(ingredient_id, new_name) for ingredient_id in ids])
+            if new_expiration_date:
+                # 新的有效日期重新計算提醒，舊的通知紀錄不再適用
+                expiration_date = db.to_db_date(new_expiration_date)
+                notify_on = reminder.next_notify_on(expiration_date, reminder.get_thresholds(owner_id))
+                conn.executemany('UPDATE ingredients SET expiration_date = ?, notify_on = ?, notified_threshold = NULL WHERE id = ?',
+                                 [(expiration_date, notify_on, ingredient_id) for ingredient_id in ids])
+                conn.executemany('DELETE FROM reminder_ledger WHERE ingredient_id = ?', [(ingredient_id,) for ingredient_id in ids])
+            version = view_cache.bump_version(conn, owner_id)
+            placeholders = ','.join('?' * len(ids))
+            rows = conn.execute(f'SELECT id, name, expiration_date FROM ingredients WHERE id IN ({placeholders})', ids).fetchall()
+        expiry_index.apply(owner_id, version, upserts=rows)
+        return ids
     except Exception as e:
         logging.error(f"修改食材時發生錯誤：{str(e)}")
+        return []
+
+# 排程提醒：每個 worker 都啟動排程器，但只有取得租約的程序會發送
+reminder_scheduler = None
+
+def start_reminder_scheduler():
+    global reminder_scheduler
+    if reminder_scheduler is None:
+        reminder_scheduler = scheduler.ReminderScheduler(reminder.send_reminders)
+        reminder_scheduler.start()
+
+def serve(args):
+    app = create_app()
+    if args.seed:
+        add_test_ingredients(args.seed)
+    app.run(host=args.host, port=args.port, debug=False)
+
+def profile_startup(args):
+    import startup_profile
+    return startup_profile.run(args)
+
+def load_test(args):
+    import load_test
+    return load_test.run(args, sys.modules[__name__])
+
+def benchmark_db(args):
+    import db_benchmark
+    return db_benchmark.run(args, sys.modules[__name__])
+
+def open_db():
+    # 不啟動伺服器的子命令只需要資料庫
+    db_path = os.getenv('DB_PATH')
+    if db_path:
+        db.configure(db_path)
+    init_db()
+
+def import_file(args):
+    import inventory_io
+    open_db()
+    return inventory_io.run_import(args)
+
+def export_file(args):
+    import inventory_io
+    open_db()
+    return inventory_io.run_export(args)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='食材管理 LINE Bot')
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser('serve', help='啟動 Webhook 伺服器（預設）')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=5000)
+    serve_parser.add_argument('--seed', metavar='OWNER_ID', help='啟動時為指定的用戶／群組新增測試食材')
+    serve_parser.set_defaults(func=serve)
+
+    profile_parser = subparsers.add_parser('profile-startup', help='量測匯入與 create_app() 的冷啟動時間')
+    profile_parser.add_argument('--top', type=int, default=15, help='列出最耗時的前 N 個匯入')
+    profile_parser.add_argument('--json', metavar='PATH', help='將結果寫入 JSON 檔以便比較')
+    profile_parser.add_argument('--budget-ms', type=float, help='超過此時間（毫秒）時以狀態碼 1 結束，預設讀取 STARTUP_BUDGET_MS')
+    profile_parser.set_defaults(func=profile_startup)
+
+    load_parser = subparsers.add_parser('load-test', help='以替身 LINE／Gemini 伺服器對 /callback 進行壓力測試')
+    load_parser.add_argument('--scenarios', type=int, default=200, help='總共執行的對話腳本數')
+    load_parser.add_argument('--concurrency', type=int, default=10, help='同時進行對話的虛擬用戶數')
+    load_parser.add_argument('--mix', default='新增=3,查詢=4,刪除=1,修改=1,食譜=1', help='各指令的權重')
+    load_parser.add_argument('--seed-rows', type=int, default=20, help='每位虛擬用戶的初始食材數')
+    load_parser.add_argument('--line-latency-ms', type=float, default=0)
+    load_parser.add_argument('--line-error-rate', type=float, default=0)
+    load_parser.add_argument('--gemini-latency-ms', type=float, default=0)
+    load_parser.add_argument('--gemini-error-rate', type=float, default=0)
+    load_parser.add_argument('--timeout', type=float, default=30, help='等待每則回覆的秒數')
+    load_parser.add_argument('--json', metavar='PATH', help='將結果寫入 JSON 檔以便比較')
+    load_parser.add_argument('--verbose', action='store_true', help='保留 INFO 等級的日誌')
+    load_parser.set_defaults(func=load_test)
+
+    benchmark_parser = subparsers.add_parser('benchmark-db', help='以不同規模的資料量測資料庫輔助函數')
+    benchmark_parser.add_argument('--rows', default='1e3,1e4,1e5', help='以逗號分隔的食材列數，例如 1e3,1e4,1e5,1e6')
+    benchmark_parser.add_argument('--rounds', type=int, default=50, help='每個函數量測的次數')
+    benchmark_parser.add_argument('--rows-per-owner', type=int, default=50, help='每個擁有者平均的食材數')
+    benchmark_parser.add_argument('--json', metavar='PATH', help='將結果寫入 JSON 檔以便比較')
+    benchmark_parser.add_argument('--baseline', metavar='PATH', help='與先前的 JSON 結果比較')
+    benchmark_parser.add_argument('--threshold', type=float, default=0.25, help='中位數超過基準多少比例算退步')
+    benchmark_parser.add_argument('--min-delta-ms', type=float, default=0.2, help='小於此差距（毫秒）的變化忽略不計')
+    benchmark_parser.set_defaults(func=benchmark_db)
+
+    import_parser = subparsers.add_parser('import', help='從 CSV／JSONL 檔案批次匯入食材')
+    import_parser.add_argument('file', help='檔案路徑，- 表示標準輸入')
+    import_parser.add_argument('--owner', required=True, help='食材歸屬的用戶／群組 ID')
+    import_parser.add_argument('--format', choices=('csv', 'jsonl'), help='預設依副檔名判斷')
+    import_parser.set_defaults(func=import_file)
+
+    export_parser = subparsers.add_parser('export', help='將食材匯出為 CSV／JSONL')
+    export_parser.add_argument('--owner', required=True, help='食材歸屬的用戶／群組 ID')
+    export_parser.add_argument('--output', help='檔案路徑，預設輸出到標準輸出')
+    export_parser.add_argument('--format', choices=('csv', 'jsonl'), help='預設依副檔名判斷')
+    export_parser.set_defaults(func=export_file)
 
-# 排程提醒
-def schedule_reminders():
-    # 設定每天指定時間執行提醒任務
-    now = datetime.now()
-    target_time = datetime.combine(now.date(), datetime.strptime("16:03", "%H:%M").time())
-    if now > target_time:
-        target_time += timedelta(days=1) 
-    delay = (target_time - now).total_seconds()
-
-    # 使用 Timer 設置延遲執行
-    threading.Timer(delay, send_reminders).start()
-    logging.info(f"提醒排程已設定，將於 {target_time.strftime('%Y-%m-%d %H:%M')} 執行")
-
-def run_schedule():
-    while True:
-        schedule.run_pending()
-        logging.debug("正在檢查排程任務")  # 修改為 DEBUG 級別
-        time.sleep(600)
+    # 未指定子命令時等同 serve
+    args = parser.parse_args(argv if argv is not None else (sys.argv[1:] or ['serve']))
+    sys.exit(args.func(args))
 
 # 運行 Flask 應用
 if __name__ == "__main__":
-    schedule_reminders()
-    schedule_thread = threading.Thread(target=run_schedule)
-    schedule_thread.start()
-    app.run(debug=False)
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,155 @@
+import io
+import os
+import csv
+import sys
+import json
+from datetime import date
+import db
+import expiry_index
+import name_index
+import reminder
+import view_cache
+
+# 每個交易寫入的列數：記憶體只保留一個批次
+CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE') or 1000)
+# 匯出時每次從游標取出的列數
+EXPORT_BATCH = 1000
+# 回報的錯誤最多列出幾筆，其餘只計數
+MAX_REPORTED_ERRORS = 100
+NAME_LIMIT = 100
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson; charset=utf-8'}
+
+
+def detect_format(name, default='csv'):
+    extension = os.path.splitext(name or '')[1].lstrip('.').lower()
+    return extension if extension in FORMATS else default
+
+
+# 逐行讀取，產生 (行號, 名稱, 日期字串)；格式錯誤的行產生 (行號, None, 錯誤訊息)
+def read_records(lines, fmt):
+    if fmt == 'jsonl':
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+                yield line_number, str(item["name"]), str(item["expiration_date"])
+            except (ValueError, KeyError, TypeError):
+                yield line_number, None, "JSON 格式錯誤"
+        return
+    for line_number, row in enumerate(csv.reader(lines), 1):
+        if not row or (line_number == 1 and [cell.strip() for cell in row[:2]] == ['name', 'expiration_date']):
+            continue
+        if len(row) != 2:
+            yield line_number, None, "欄位數錯誤"
+            continue
+        yield line_number, row[0], row[1]
+
+
+# 以取代字元解碼，非 UTF-8 的內容在 validate 中當作該行的錯誤回報，不會中斷整個匯入
+def decode_lines(raw_lines):
+    for raw in raw_lines:
+        yield raw.decode('utf-8-sig', errors='replace')
+
+
+def validate(name, expiration_text, today):
+    # 名稱不可空白且最多 NAME_LIMIT 字；日期須為今天或之後（「新增」不接受今天），接受 YYYY/MM/DD 與 YYYY-MM-DD
+    if '\ufffd' in name or '\ufffd' in expiration_text:
+        return None, "編碼錯誤，請使用 UTF-8"
+    name = name.strip()
+    if not name or len(name) > NAME_LIMIT:
+        return None, "名稱空白或過長"
+    try:
+        expiration_date = db.to_db_date(expiration_text.strip().replace('-', '/'))
+    except ValueError:
+        return None, f"日期無效：{expiration_text}"
+    if expiration_date < today:
+        return None, f"日期已過：{expiration_text}"
+    return (name, expiration_date), None
+
+
+@db.timed('import_chunk')
+def _insert_chunk(owner_id, chunk):
+    with db.transaction() as conn:
+        ids = [conn.execute('INSERT INTO ingredients (owner_id, name, expiration_date, notify_on) VALUES (?, ?, ?, ?)', row).lastrowid
+               for row in chunk]
+        name_index.index(conn, owner_id, [(ingredient_id, row[1]) for ingredient_id, row in zip(ids, chunk)])
+        version = view_cache.bump_version(conn, owner_id)
+    expiry_index.apply(owner_id, version, upserts=[(ingredient_id, row[1], row[2]) for ingredient_id, row in zip(ids, chunk)])
+
+
+# 單次走訪：驗證後累積到一個批次就寫入，已寫入的批次不會因後面的錯誤而回復
+def import_inventory(owner_id, lines, fmt='csv', chunk_size=CHUNK_SIZE):
+    if fmt not in FORMATS:
+        raise ValueError(f"不支援的格式：{fmt}")
+    thresholds = reminder.get_thresholds(owner_id)
+    today = date.today().isoformat()
+    result = {"imported": 0, "failed": 0, "errors": []}
+    chunk = []
+    for line_number, name, value in read_records(lines, fmt):
+        error = value if name is None else None
+        if error is None:
+            item, error = validate(name, value, today)
+        if error is not None:
+            result["failed"] += 1
+            if len(result["errors"]) < MAX_REPORTED_ERRORS:
+                result["errors"].append(f"第 {line_number} 行：{error}")
+            continue
+        chunk.append((owner_id, item[0], item[1], reminder.next_notify_on(item[1], thresholds)))
+        if len(chunk) >= chunk_size:
+            _insert_chunk(owner_id, chunk)
+            result["imported"] += len(chunk)
+            chunk = []
+    if chunk:
+        _insert_chunk(owner_id, chunk)
+        result["imported"] += len(chunk)
+    return result
+
+
+# 產生器：以游標分批取出，每批轉成一段文字，不會一次載入全部資料
+def export_inventory(owner_id, fmt='csv'):
+    cursor = db.get_connection().execute(
+        'SELECT name, expiration_date FROM ingredients WHERE owner_id = ? ORDER BY expiration_date, id', (owner_id,))
+    try:
+        if fmt == 'csv':
+            yield 'name,expiration_date\r\n'
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH)
+            if not rows:
+                break
+            buffer = io.StringIO()
+            if fmt == 'csv':
+                csv.writer(buffer).writerows(rows)
+            else:
+                for name, expiration_date in rows:
+                    buffer.write(json.dumps({"name": name, "expiration_date": expiration_date}, ensure_ascii=False) + '\n')
+            yield buffer.getvalue()
+    finally:
+        cursor.close()
+
+
+# CLI 子命令：檔案為 - 時使用標準輸入／輸出
+def run_import(args):
+    fmt = args.format or detect_format(args.file)
+    if args.file == '-':
+        result = import_inventory(args.owner, io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', errors='replace', newline=''), fmt)
+    else:
+        with open(args.file, encoding='utf-8-sig', errors='replace', newline='') as f:
+            result = import_inventory(args.owner, f, fmt)
+    print(f"已匯入 {result['imported']} 筆，失敗 {result['failed']} 筆")
+    for error in result["errors"]:
+        print(error)
+    return 1 if result["failed"] else 0
+
+
+def run_export(args):
+    fmt = args.format or detect_format(args.output)
+    if args.output in (None, '-'):
+        for chunk in export_inventory(args.owner, fmt):
+            sys.stdout.write(chunk)
+    else:
+        with open(args.output, 'w', encoding='utf-8', newline='') as f:
+            for chunk in export_inventory(args.owner, fmt):
+                f.write(chunk)
+    return 0
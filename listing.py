@@ -0,0 +1,58 @@
+from datetime import date
+import db
+
+# 每頁顯示的食材數，每個 bubble 顯示的列數（carousel 最多 12 個 bubble）
+PAGE_SIZE = 10
+ROWS_PER_BUBBLE = 5
+# 名稱過長時截斷，讓每頁的訊息大小維持固定上限
+NAME_LIMIT = 20
+
+SORT_LABELS = {"expiration": "到期日", "name": "名稱"}
+
+
+def _truncate(name):
+    return name if len(name) <= NAME_LIMIT else name[:NAME_LIMIT - 1] + "…"
+
+
+def _row(number, name, expiration_date, today):
+    days_left = (date.fromisoformat(expiration_date) - today).days
+    return {
+        "type": "box", "layout": "horizontal", "spacing": "sm",
+        "contents": [
+            {"type": "text", "text": str(number), "size": "sm", "color": "#888888", "flex": 1},
+            {"type": "text", "text": _truncate(name), "size": "sm", "weight": "bold", "flex": 5, "wrap": True},
+            {"type": "text", "text": db.to_display_date(expiration_date), "size": "xs", "flex": 4, "align": "end",
+             "color": "#e53935" if days_left <= 1 else "#555555"},
+        ],
+    }
+
+
+def _navigation_bubble(has_next, sort):
+    other_sort = "name" if sort == "expiration" else "expiration"
+    buttons = []
+    if has_next:
+        buttons.append({"type": "button", "style": "primary", "height": "sm",
+                        "action": {"type": "message", "label": "下一頁", "text": "下一頁"}})
+    buttons.append({"type": "button", "style": "secondary", "height": "sm",
+                    "action": {"type": "message", "label": f"依{SORT_LABELS[other_sort]}排序", "text": f"查詢 {SORT_LABELS[other_sort]}"}})
+    return {"type": "bubble", "size": "micro",
+            "body": {"type": "box", "layout": "vertical", "spacing": "sm", "contents": buttons}}
+
+
+# 一頁食材轉成 Flex carousel，編號從 start 開始
+def render_page(rows, start, has_next, sort):
+    from linebot.models import FlexSendMessage
+    today = date.today()
+    bubbles = []
+    for offset in range(0, len(rows), ROWS_PER_BUBBLE):
+        chunk = rows[offset:offset + ROWS_PER_BUBBLE]
+        bubbles.append({
+            "type": "bubble", "size": "kilo",
+            "body": {
+                "type": "box", "layout": "vertical", "spacing": "md",
+                "contents": [_row(start + offset + index, row[1], row[2], today) for index, row in enumerate(chunk)],
+            },
+        })
+    bubbles.append(_navigation_bubble(has_next, sort))
+    alt_text = "\n".join(f"{start + index}. {_truncate(row[1])} (有效日期：{db.to_display_date(row[2])})" for index, row in enumerate(rows))
+    return FlexSendMessage(alt_text=alt_text[:400], contents={"type": "carousel", "contents": bubbles})
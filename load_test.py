@@ -0,0 +1,383 @@
+import os
+import json
+import time
+import uuid
+import base64
+import hashlib
+import hmac
+import random
+import logging
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import db
+import clients
+
+# 每種指令對應的對話腳本：同一位虛擬用戶依序送出，等上一則回覆後才送下一則
+SCENARIOS = {
+    "新增": lambda n: ["新增", f"測試食材{n} 2099/01/01"],
+    "查詢": lambda n: ["查詢"],
+    "刪除": lambda n: ["刪除", "1"],
+    "修改": lambda n: ["修改", "1", "1", f"改名食材{n}"],
+    "食譜": lambda n: ["食譜", f"雞蛋 番茄 {n}"],
+}
+DEFAULT_MIX = "新增=3,查詢=4,刪除=1,修改=1,食譜=1"
+STAGES = ("ack", "signature", "queue", "db", "gemini", "reply", "total")
+
+_local = threading.local()
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        command, _, weight = item.partition('=')
+        command = command.strip()
+        if command not in SCENARIOS:
+            raise ValueError(f"未知的指令：{command}")
+        mix[command] = float(weight or 1)
+    return mix
+
+
+def sign(secret, body):
+    digest = hmac.new(secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+def build_payload(user_id, text, reply_token):
+    return json.dumps({
+        "destination": "Uload-test",
+        "events": [{
+            "type": "message",
+            "mode": "active",
+            "timestamp": int(time.time() * 1000),
+            "webhookEventId": uuid.uuid4().hex.upper(),
+            "deliveryContext": {"isRedelivery": False},
+            "source": {"type": "user", "userId": user_id},
+            "replyToken": reply_token,
+            "message": {"type": "text", "id": str(random.getrandbits(48)), "text": text},
+        }],
+    }, ensure_ascii=False)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+# 本機的 LINE Messaging API 與 Gemini 替身，可設定延遲與錯誤率
+class StubServer:
+    def __init__(self, respond, latency_ms=0, error_rate=0):
+        self.respond = respond
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                failed = random.random() < stub.error_rate
+                with stub._lock:
+                    stub.requests += 1
+                    stub.errors += failed
+                if stub.latency_ms:
+                    # 延遲在設定值的 ±20% 之間浮動
+                    time.sleep(stub.latency_ms * random.uniform(0.8, 1.2) / 1000)
+                status, body = (500, {"message": "stub error"}) if failed else (200, stub.respond(self.path))
+                data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='load-test-stub', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _line_response(path):
+    return {}
+
+
+def _gemini_response(path):
+    return {"candidates": [{
+        "content": {"role": "model", "parts": [{"text": "替身食譜：所有食材切塊拌炒即可。"}]},
+        "finishReason": "STOP",
+        "index": 0,
+    }]}
+
+
+# 以執行緒區域變數記錄目前處理中的事件，巢狀的資料庫呼叫只計算最外層
+@contextmanager
+def _stage(name):
+    record = getattr(_local, 'record', None)
+    if record is None or getattr(_local, 'depth', 0):
+        yield
+        return
+    _local.depth = 1
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        record["errors"].append(name)
+        raise
+    finally:
+        record[name] += time.perf_counter() - start
+        _local.depth = 0
+
+
+def _timed(name, func):
+    def wrapper(*args, **kwargs):
+        with _stage(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+# 在受測程序中包裝簽章驗證、事件處理、資料庫、Gemini 與回覆，逐一事件記錄各階段時間
+def instrument(app_module, records):
+    original_transaction = db.transaction
+
+    @contextmanager
+    def transaction():
+        with _stage("db"):
+            with original_transaction() as conn:
+                yield conn
+
+    for name in ('query_all', 'query_one', 'execute', 'executemany'):
+        setattr(db, name, _timed("db", getattr(db, name)))
+    db.transaction = transaction
+
+    parser = clients.get_webhook_parser()
+    original_parse = parser.parse
+
+    def parse(body, signature):
+        start = time.perf_counter()
+        events = original_parse(body, signature)
+        parsed = time.perf_counter()
+        for event in events:
+            record = records.get(event.reply_token)
+            if record is not None:
+                record["signature"] = parsed - start
+                record["parsed"] = parsed
+        return events
+
+    parser.parse = parse
+    line_bot_api = clients.get_line_bot_api()
+    line_bot_api.reply_message = _timed("reply", line_bot_api.reply_message)
+    # Gemini 在另一個執行緒池中呼叫，在事件執行緒等待結果的地方計時（含逾時）
+    app_module.generate_recipe = _timed("gemini", app_module.generate_recipe)
+
+    original_dispatch = app_module.dispatch_event
+
+    def dispatch_event(event):
+        record = records.get(event.reply_token)
+        if record is None:
+            return original_dispatch(event)
+        record["started"] = time.perf_counter()
+        _local.record = record
+        try:
+            original_dispatch(event)
+        except Exception:
+            record["errors"].append("handler")
+            raise
+        finally:
+            _local.record = None
+            record["done"] = time.perf_counter()
+            record["finished"].set()
+
+    app_module.dispatch_event = dispatch_event
+
+
+def _new_record(command):
+    return {"command": command, "sent": 0.0, "acked": 0.0, "parsed": 0.0, "started": 0.0, "done": 0.0,
+            "signature": 0.0, "db": 0.0, "gemini": 0.0, "reply": 0.0, "errors": [], "finished": threading.Event()}
+
+
+def _send(url, secret, user_id, text, command, records, timeout):
+    reply_token = uuid.uuid4().hex
+    record = _new_record(command)
+    records[reply_token] = record
+    body = build_payload(user_id, text, reply_token)
+    http_request = urllib.request.Request(url, data=body.encode('utf-8'), method='POST', headers={
+        'Content-Type': 'application/json',
+        'X-Line-Signature': sign(secret, body),
+    })
+    record["sent"] = time.perf_counter()
+    try:
+        with urllib.request.urlopen(http_request, timeout=timeout) as response:
+            response.read()
+    except urllib.error.HTTPError as e:
+        record["errors"].append(f"http {e.code}")
+        record["finished"].set()
+    except Exception:
+        record["errors"].append("http")
+        record["finished"].set()
+    record["acked"] = time.perf_counter()
+    if not record["finished"].wait(timeout):
+        record["errors"].append("timeout")
+    return record
+
+
+def _stage_values(record):
+    if not record["done"]:
+        return {"ack": record["acked"] - record["sent"]}
+    return {
+        "ack": record["acked"] - record["sent"],
+        "signature": record["signature"],
+        "queue": max(0.0, record["started"] - (record["parsed"] or record["acked"])),
+        "db": record["db"],
+        "gemini": record["gemini"],
+        "reply": record["reply"],
+        "total": record["done"] - record["sent"],
+    }
+
+
+def summarize(records, elapsed):
+    commands = {}
+    for record in records:
+        summary = commands.setdefault(record["command"], {"events": 0, "errors": 0, "stages": {stage: [] for stage in STAGES}})
+        summary["events"] += 1
+        summary["errors"] += bool(record["errors"])
+        for stage, seconds in _stage_values(record).items():
+            summary["stages"][stage].append(seconds * 1000)
+    report = {"elapsed_s": elapsed, "events": len(records), "throughput": len(records) / elapsed if elapsed else 0.0, "commands": {}}
+    for command, summary in commands.items():
+        report["commands"][command] = {
+            "events": summary["events"],
+            "errors": summary["errors"],
+            "stages": {
+                stage: {"p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99)}
+                for stage, values in summary["stages"].items() if values
+            },
+        }
+    return report
+
+
+def format_report(report):
+    lines = [
+        f"事件數：{report['events']}，耗時 {report['elapsed_s']:.2f} 秒，吞吐量 {report['throughput']:.1f} 事件/秒",
+        f"{'指令':<6}{'階段':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}",
+    ]
+    for command, summary in report["commands"].items():
+        lines.append(f"{command}（{summary['events']} 個事件，{summary['errors']} 個錯誤）")
+        for stage, values in summary["stages"].items():
+            lines.append(f"{'':<8}{stage:<10}{values['p50']:>10.2f}{values['p95']:>10.2f}{values['p99']:>10.2f}")
+    if "stubs" in report:
+        lines.append("替身伺服器：" + "，".join(f"{name} {stub['requests']} 次請求／{stub['errors']} 次錯誤" for name, stub in report["stubs"].items()))
+    return "\n".join(lines)
+
+
+def load_test(app_module, scenarios=200, concurrency=10, mix=DEFAULT_MIX, seed_rows=20,
+              line_latency_ms=0, line_error_rate=0, gemini_latency_ms=0, gemini_error_rate=0, timeout=30):
+    from werkzeug.serving import make_server
+
+    weights = parse_mix(mix)
+    line_stub = StubServer(_line_response, line_latency_ms, line_error_rate).start()
+    gemini_stub = StubServer(_gemini_response, gemini_latency_ms, gemini_error_rate).start()
+    secret = uuid.uuid4().hex
+    # 在第一次建立用戶端之前指向替身伺服器，不使用真正的憑證
+    os.environ.update({
+        'LINE_CHANNEL_SECRET': secret,
+        'LINE_CHANNEL_ACCESS_TOKEN': 'load-test',
+        'KEY': 'load-test',
+        'LINE_API_ENDPOINT': line_stub.url,
+        'GEMINI_API_ENDPOINT': gemini_stub.url,
+        'RUN_SCHEDULER': '0',
+        'WARM_UP': '0',
+    })
+    records = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        app = app_module.create_app(os.path.join(tmp, 'load-test.db'))
+        instrument(app_module, records)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, name='load-test-server', daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/callback"
+
+        # 每個並行的虛擬用戶各自擁有一份初始庫存
+        user_ids = [f"U{uuid.uuid4().hex}" for _ in range(concurrency)]
+        for user_id in user_ids:
+            app_module.add_ingredients(user_id, [(f"庫存食材{n}", "2099/01/01") for n in range(seed_rows)])
+
+        plan = random.choices(list(weights), weights=list(weights.values()), k=scenarios)
+        plan_lock = threading.Lock()
+        results = []
+
+        def run_user(user_id):
+            while True:
+                with plan_lock:
+                    if not plan:
+                        return
+                    number = len(plan)
+                    command = plan.pop()
+                for text in SCENARIOS[command](number):
+                    record = _send(url, secret, user_id, text, command, records, timeout)
+                    results.append(record)
+                    if record["errors"]:
+                        break
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=run_user, args=(user_id,), name=f"load-test-user-{index}") for index, user_id in enumerate(user_ids)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+        app_module.dispatcher.join()
+        db.close_all()
+
+    line_stub.stop()
+    gemini_stub.stop()
+    report = summarize(results, elapsed)
+    report["stubs"] = {
+        "LINE": {"requests": line_stub.requests, "errors": line_stub.errors},
+        "Gemini": {"requests": gemini_stub.requests, "errors": gemini_stub.errors},
+    }
+    return report
+
+
+# CLI 子命令：在同一程序中啟動應用與替身伺服器，輸出各指令與階段的延遲分佈
+def run(args, app_module):
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    report = load_test(
+        app_module,
+        scenarios=args.scenarios,
+        concurrency=args.concurrency,
+        mix=args.mix,
+        seed_rows=args.seed_rows,
+        line_latency_ms=args.line_latency_ms,
+        line_error_rate=args.line_error_rate,
+        gemini_latency_ms=args.gemini_latency_ms,
+        gemini_error_rate=args.gemini_error_rate,
+        timeout=args.timeout,
+    )
+    print(format_report(report))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
@@ -0,0 +1,80 @@
+import os
+import atexit
+import queue
+import random
+import hashlib
+import logging
+import logging.handlers
+import threading
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# 標記為 sample 的高頻日誌只保留這個比例（LOG_SAMPLE_RATE，0～1）
+DEFAULT_SAMPLE_RATE = 0.1
+# 這些欄位的值是 LINE 用戶／群組 ID，輸出前以雜湊取代
+REDACTED_FIELDS = ('user', 'owner')
+
+_listener = None
+_lock = threading.Lock()
+
+
+def fields(sample=False, **values):
+    # 供 logging 的 extra 參數使用：logging.info("收到訊息", extra=fields(sample=True, user=user_id))
+    return {"fields": values, "sample": sample}
+
+
+def redact(identifier):
+    if not identifier:
+        return '-'
+    salt = os.getenv('LOG_REDACT_SALT') or ''
+    return hashlib.sha256((salt + identifier).encode('utf-8')).hexdigest()[:12]
+
+
+def _format_field(value):
+    text = str(value)
+    return f'"{text}"' if not text or ' ' in text or '"' in text else text
+
+
+# 在背景執行緒輸出時才組合欄位與雜湊 ID，請求執行緒只負責排入佇列
+class StructuredFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        values = getattr(record, 'fields', None)
+        if not values:
+            return text
+        pairs = ((key, redact(value) if key in REDACTED_FIELDS else value) for key, value in values.items())
+        return text + ' ' + ' '.join(f"{key}={_format_field(value)}" for key, value in pairs)
+
+
+# 在排入佇列之前丟棄未被抽中的高頻日誌，警告與錯誤一律保留
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not getattr(record, 'sample', False):
+            return True
+        return random.random() < self.rate
+
+
+# 以 QueueHandler 取代根記錄器的處理器，實際寫入由 QueueListener 的背景執行緒負責
+def configure():
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        root = logging.getLogger()
+        level = os.getenv('LOG_LEVEL')
+        if level:
+            root.setLevel(level.upper())
+        output = logging.StreamHandler()
+        output.setFormatter(StructuredFormatter(LOG_FORMAT))
+        log_queue = queue.SimpleQueue()
+        handler = logging.handlers.QueueHandler(log_queue)
+        handler.addFilter(SamplingFilter(float(os.getenv('LOG_SAMPLE_RATE') or DEFAULT_SAMPLE_RATE)))
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
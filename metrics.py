@@ -0,0 +1,144 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# 延遲直方圖的預設桶（秒），涵蓋 SQLite 查詢到 Gemini 呼叫
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+# 計數器：只會增加，例如請求數與錯誤數
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name, _format_labels(self.labels, key), value) for key, value in sorted(values.items())]
+
+
+# 直方圖：每個標籤組合記錄各桶的次數、總和與次數，observe 只需一次二分搜尋
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(entry[0]), entry[1], entry[2]) for key, entry in self._values.items()}
+        samples = []
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                samples.append((f"{self.name}_bucket", _format_labels(self.labels, key, [('le', le)]), cumulative))
+            samples.append((f"{self.name}_sum", _format_labels(self.labels, key), total))
+            samples.append((f"{self.name}_count", _format_labels(self.labels, key), count))
+        return samples
+
+
+# 量表：輸出時才呼叫函數取值，例如佇列長度與快取大小；函數可回傳 {標籤值: 數值}
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, func, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.func = func
+        self.labels = tuple(labels)
+
+    def samples(self):
+        value = self.func()
+        if isinstance(value, dict):
+            return [(self.name, _format_labels(self.labels, key if isinstance(key, tuple) else (key,)), item)
+                    for key, item in sorted(value.items())]
+        return [(self.name, '', value)]
+
+
+def _register(metric):
+    with _lock:
+        _registry.append(metric)
+    return metric
+
+
+def counter(name, help_text, labels=()):
+    return _register(Counter(name, help_text, labels))
+
+
+def histogram(name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, help_text, labels, buckets))
+
+
+def gauge(name, help_text, func, labels=()):
+    return _register(Gauge(name, help_text, func, labels))
+
+
+# Prometheus 文字格式（text/plain; version=0.0.4）
+def render():
+    with _lock:
+        registry = list(_registry)
+    lines = []
+    for metric in registry:
+        try:
+            samples = metric.samples()
+        except Exception:
+            # 量表的取值函數失敗時略過，不影響其他指標
+            continue
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines += [f"{name}{labels} {_format_value(value)}" for name, labels, value in samples]
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
@@ -0,0 +1,52 @@
+import math
+import db
+
+# 食材名稱的字元 n-gram 索引：每個名稱拆成單字與相鄰兩字（例如「高麗菜」→ 高、麗、菜、高麗、麗菜），
+# 中文不需要分詞，搜尋時以共同 n-gram 數排名，只讀取查詢字元對應的索引範圍
+SEARCH_LIMIT = 10
+
+
+def grams(text):
+    chars = [char for char in text.lower() if not char.isspace()]
+    return set(chars) | {chars[index] + chars[index + 1] for index in range(len(chars) - 1)}
+
+
+def index(conn, owner_id, items):
+    # items 為 (ingredient_id, name)，必須在寫入食材的同一個交易中呼叫
+    conn.executemany('INSERT OR IGNORE INTO name_grams (owner_id, gram, ingredient_id) VALUES (?, ?, ?)',
+                     [(owner_id, gram, ingredient_id) for ingredient_id, name in items for gram in grams(name)])
+
+
+def reindex(conn, owner_id, items):
+    conn.executemany('DELETE FROM name_grams WHERE ingredient_id = ?', [(ingredient_id,) for ingredient_id, name in items])
+    index(conn, owner_id, items)
+
+
+def rebuild(conn):
+    conn.execute('DELETE FROM name_grams')
+    cursor = conn.execute('SELECT id, owner_id, name FROM ingredients')
+    while True:
+        rows = cursor.fetchmany(1000)
+        if not rows:
+            break
+        conn.executemany('INSERT OR IGNORE INTO name_grams (owner_id, gram, ingredient_id) VALUES (?, ?, ?)',
+                         [(owner_id, gram, ingredient_id) for ingredient_id, owner_id, name in rows for gram in grams(name)])
+
+
+# 回傳 (id, name, expiration_date)：完全包含查詢字串的優先，其次依共同 n-gram 數、名稱長度與到期日
+# 至少要符合一半的查詢 n-gram，避免只有一個常見字相同的結果
+@db.timed('search_ingredients')
+def search(owner_id, query, limit=SEARCH_LIMIT):
+    query_grams = sorted(grams(query))
+    if not query_grams:
+        return []
+    placeholders = ','.join('?' * len(query_grams))
+    return db.query_all(f'''
+        SELECT i.id, i.name, i.expiration_date
+        FROM name_grams g JOIN ingredients i ON i.id = g.ingredient_id
+        WHERE g.owner_id = ? AND g.gram IN ({placeholders})
+        GROUP BY i.id
+        HAVING COUNT(*) >= ?
+        ORDER BY instr(lower(i.name), ?) > 0 DESC, COUNT(*) DESC, length(i.name), i.expiration_date, i.id
+        LIMIT ?
+    ''', (owner_id, *query_grams, math.ceil(len(query_grams) / 2), query.strip().lower(), limit))
@@ -0,0 +1,99 @@
+import os
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+import db
+
+# 記憶體層最多保留的食譜數量
+MEMORY_CACHE_SIZE = int(os.getenv('RECIPE_CACHE_SIZE') or 256)
+# SQLite 層的有效時間（秒）與最多保留的筆數
+CACHE_TTL = int(os.getenv('RECIPE_CACHE_TTL') or 7 * 24 * 3600)
+CACHE_MAX_ROWS = int(os.getenv('RECIPE_CACHE_MAX_ROWS') or 5000)
+
+_memory = OrderedDict()
+_lock = threading.Lock()
+_stats = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+
+# 食材之間可用空白或常見的中英文分隔符號
+_SEPARATORS = re.compile(r'[\s,，、;；]+')
+
+
+def normalize_key(text):
+    # 順序、空白與重複的食材都不影響快取鍵
+    names = {name.lower() for name in _SEPARATORS.split(text) if name}
+    return ' '.join(sorted(names))
+
+
+def _remember(key, recipe, created_at):
+    with _lock:
+        _memory[key] = (recipe, created_at)
+        _memory.move_to_end(key)
+        while len(_memory) > MEMORY_CACHE_SIZE:
+            _memory.popitem(last=False)
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+@db.timed('get_recipe')
+def get(text):
+    key = normalize_key(text)
+    if not key:
+        return None
+    now = time.time()
+    with _lock:
+        entry = _memory.get(key)
+        if entry is not None and now - entry[1] < CACHE_TTL:
+            _memory.move_to_end(key)
+            _stats["memory_hits"] += 1
+            return entry[0]
+        _memory.pop(key, None)
+    try:
+        row = db.query_one('SELECT recipe, created_at FROM recipe_cache WHERE ingredients_key = ? AND created_at > ?', (key, now - CACHE_TTL))
+        if row is not None:
+            db.execute('UPDATE recipe_cache SET last_used_at = ? WHERE ingredients_key = ?', (now, key))
+            _remember(key, row[0], row[1])
+            _count("db_hits")
+            return row[0]
+    except Exception as e:
+        logging.error(f"讀取食譜快取時發生錯誤：{str(e)}")
+    _count("misses")
+    return None
+
+
+@db.timed('put_recipe')
+def put(text, recipe):
+    key = normalize_key(text)
+    if not key:
+        return
+    now = time.time()
+    _remember(key, recipe, now)
+    try:
+        with db.transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO recipe_cache (ingredients_key, recipe, created_at, last_used_at) VALUES (?, ?, ?, ?)', (key, recipe, now, now))
+            # 淘汰過期與超出上限（最久未使用）的食譜
+            conn.execute('DELETE FROM recipe_cache WHERE created_at <= ?', (now - CACHE_TTL,))
+            conn.execute('''
+                DELETE FROM recipe_cache WHERE ingredients_key IN (
+                    SELECT ingredients_key FROM recipe_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (CACHE_MAX_ROWS,))
+    except Exception as e:
+        logging.error(f"寫入食譜快取時發生錯誤：{str(e)}")
+
+
+def stats():
+    with _lock:
+        result = dict(_stats)
+        result["memory_size"] = len(_memory)
+    return result
+
+
+@db.on_configure
+def clear_memory():
+    with _lock:
+        _memory.clear()
@@ -1,36 +1,233 @@
 import logging
-from linebot import LineBotApi
-from linebot.models import TextSendMessage
 import os
-import sqlite3
-from datetime import datetime, timedelta
+import time
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+import clients
+import db
+import metrics
+import scheduler
 
-# 初始化 LINE API
-line_bot_api = LineBotApi(os.getenv('LINE_CHANNEL_ACCESS_TOKEN'))
+# LINE multicast 每次最多 500 位接收者，單則文字訊息最多 5000 字
+MULTICAST_LIMIT = 500
+MESSAGE_LIMIT = 5000
+# 同時進行的 LINE API 呼叫數與每秒呼叫上限
+SEND_WORKERS = int(os.getenv('REMINDER_SEND_WORKERS') or 8)
+SEND_RATE_LIMIT = float(os.getenv('REMINDER_RATE_LIMIT') or 100)
+# 遇到 429 或伺服器錯誤時的重試次數
+SEND_RETRIES = 3
 
-def send_reminders():
+REMINDER_RUN_SECONDS = metrics.histogram('linebot_reminder_run_seconds', '每次提醒執行的耗時（秒）',
+                                         buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900))
+REMINDER_RECIPIENTS = metrics.counter('linebot_reminder_recipients_total', '提醒接收者數', ('result',))
+
+
+# Token bucket：所有傳送執行緒共用，平均速率不超過 rate 次/秒
+class RateLimiter:
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# 預設在到期前 3 天、前 1 天與到期當天（含已過期）各提醒一次
+DEFAULT_THRESHOLDS = (3, 1, 0)
+# 門檻天數上限：過大的天數會讓到期日減去天數超出日期範圍
+MAX_THRESHOLD = 365
+
+
+def parse_thresholds(text):
+    # 「3,1,0」或「3 1 0」，回傳由大到小排列的天數；格式錯誤時拋出 ValueError
+    thresholds = sorted({int(part) for part in text.replace('，', ',').replace(',', ' ').split()}, reverse=True)
+    if not thresholds or thresholds[-1] < 0 or thresholds[0] > MAX_THRESHOLD:
+        raise ValueError(text)
+    return tuple(thresholds)
+
+@db.timed('get_thresholds')
+def get_thresholds(owner_id):
+    row = db.query_one('SELECT thresholds FROM reminder_thresholds WHERE owner_id = ?', (owner_id,))
+    if row is None:
+        return DEFAULT_THRESHOLDS
     try:
-        # 連接到資料庫
-        conn = sqlite3.connect('data/ingredients.db')
-        cursor = conn.cursor()
-
-        # 獲取即將過期的食材
-        expiration_date_limit = (datetime.now() + timedelta(days=3)).strftime('%Y/%m/%d')
-        cursor.execute('SELECT name, expiration_date FROM ingredients WHERE expiration_date <= ?', (expiration_date_limit,))
-        rows = cursor.fetchall()
-
-        # 獲取所有用戶 ID
-        cursor.execute('SELECT user_id FROM users')
-        user_ids = cursor.fetchall()
-        conn.close()
-
-        if rows:
-            for row in rows:
-                message = f"提醒：{row[0]} 即將於 {row[1]} 過期！"
-                for user_id in user_ids:
-                    line_bot_api.push_message(user_id[0], TextSendMessage(text=message))
-                    logging.info(f"已發送提醒給用戶 {user_id[0]}：{message}")
+        return parse_thresholds(row[0])
+    except ValueError:
+        # 加入上限之前存入的超出範圍設定，改用預設門檻
+        return DEFAULT_THRESHOLDS
+
+# 下一個尚未通知的門檻被跨過的日期；全部通知過則為 None
+def next_notify_on(expiration_date, thresholds, notified_threshold=None):
+    pending = [t for t in thresholds if notified_threshold is None or t < notified_threshold]
+    if not pending:
+        return None
+    return (date.fromisoformat(expiration_date) - timedelta(days=max(pending))).isoformat()
+
+# 更改門檻後重新計算該擁有者所有食材的下次通知日期
+@db.timed('set_thresholds')
+def set_thresholds(owner_id, thresholds):
+    with db.transaction() as conn:
+        conn.execute('''
+            INSERT INTO reminder_thresholds (owner_id, thresholds) VALUES (?, ?)
+            ON CONFLICT(owner_id) DO UPDATE SET thresholds = excluded.thresholds
+        ''', (owner_id, ','.join(map(str, thresholds))))
+        rows = conn.execute('SELECT id, expiration_date, notified_threshold FROM ingredients WHERE owner_id = ?', (owner_id,)).fetchall()
+        conn.executemany('UPDATE ingredients SET notify_on = ? WHERE id = ?',
+                         [(next_notify_on(expiration_date, thresholds, notified), ingredient_id) for ingredient_id, expiration_date, notified in rows])
+
+# 只取下次通知日期已到的食材（notify_on 索引範圍查詢），工作量與新跨過門檻的食材數成正比
+# 指定 reminder_time 時只取提醒時間為該時間的擁有者
+@db.timed('get_due_notifications')
+def get_due_notifications(today, reminder_time=None):
+    return db.query_all('''
+        SELECT i.id, i.owner_id, i.name, i.expiration_date, i.notified_threshold, i.notify_on, t.thresholds
+        FROM ingredients i
+        LEFT JOIN reminder_settings s ON s.owner_id = i.owner_id
+        LEFT JOIN reminder_thresholds t ON t.owner_id = i.owner_id
+        WHERE i.notify_on <= ? AND i.owner_id != '' AND (? IS NULL OR COALESCE(s.reminder_time, ?) = ?)
+        ORDER BY i.expiration_date
+    ''', (today.isoformat(), reminder_time, scheduler.default_reminder_time(), reminder_time))
+
+# 為每個到期的食材選出已跨過的最小門檻，寫入通知紀錄並推進下次通知日期
+# 已有相同 (食材, 門檻) 紀錄的不會再次通知
+@db.timed('claim_notifications')
+def claim_notifications(rows, today):
+    claims = []
+    now = time.time()
+    with db.transaction() as conn:
+        for ingredient_id, owner_id, name, expiration_date, notified, notify_on, thresholds_text in rows:
+            thresholds = parse_thresholds(thresholds_text) if thresholds_text else DEFAULT_THRESHOLDS
+            days_left = (date.fromisoformat(expiration_date) - today).days
+            crossed = [t for t in thresholds if days_left <= t and (notified is None or t < notified)]
+            threshold = min(crossed) if crossed else notified
+            conn.execute('UPDATE ingredients SET notified_threshold = ?, notify_on = ? WHERE id = ?',
+                         (threshold, next_notify_on(expiration_date, thresholds, threshold), ingredient_id))
+            if not crossed:
+                continue
+            inserted = conn.execute('INSERT OR IGNORE INTO reminder_ledger (ingredient_id, threshold, sent_at) VALUES (?, ?, ?)',
+                                    (ingredient_id, threshold, now)).rowcount
+            if inserted:
+                claims.append((ingredient_id, owner_id, name, expiration_date, threshold, notified, notify_on))
+    return claims
+
+# 發送失敗的擁有者：撤銷通知紀錄，下次執行時重試
+@db.timed('release_notifications')
+def release_notifications(claims):
+    with db.transaction() as conn:
+        for ingredient_id, owner_id, name, expiration_date, threshold, notified, notify_on in claims:
+            conn.execute('DELETE FROM reminder_ledger WHERE ingredient_id = ? AND threshold = ?', (ingredient_id, threshold))
+            conn.execute('UPDATE ingredients SET notified_threshold = ?, notify_on = ? WHERE id = ?', (notified, notify_on, ingredient_id))
+
+def describe_days_left(days_left):
+    if days_left < 0:
+        return "已過期"
+    if days_left == 0:
+        return "今天到期"
+    return f"{days_left} 天後到期"
+
+# 每位接收者一則摘要訊息，超過長度上限時截斷
+def build_digest(rows, today):
+    header = "提醒：以下食材即將過期！"
+    lines = [header]
+    length = len(header)
+    for index, (name, expiration_date) in enumerate(rows):
+        days_left = (date.fromisoformat(expiration_date) - today).days
+        line = f"{name}（{db.to_display_date(expiration_date)}，{describe_days_left(days_left)}）"
+        if length + len(line) + 20 > MESSAGE_LIMIT:
+            lines.append(f"……還有 {len(rows) - index} 項")
+            break
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)
+
+# 內容相同的接收者合併為 multicast，每批最多 MULTICAST_LIMIT 人
+# multicast 只接受用戶 ID（U 開頭），群組與聊天室個別以 push 傳送
+def plan_sends(digests):
+    recipients_by_text = defaultdict(list)
+    sends = []
+    for recipient, text in digests.items():
+        if recipient.startswith('U'):
+            recipients_by_text[text].append(recipient)
+        else:
+            sends.append(([recipient], text))
+    for text, recipients in recipients_by_text.items():
+        for start in range(0, len(recipients), MULTICAST_LIMIT):
+            sends.append((recipients[start:start + MULTICAST_LIMIT], text))
+    return sends
+
+def _send(recipients, text, limiter):
+    from linebot.exceptions import LineBotApiError
+    from linebot.models import TextSendMessage
+    line_bot_api = clients.get_line_bot_api()
+    message = TextSendMessage(text=text)
+    for attempt in range(SEND_RETRIES + 1):
+        limiter.acquire()
+        try:
+            if len(recipients) == 1:
+                with clients.line_api_call('push'):
+                    line_bot_api.push_message(recipients[0], message)
+            else:
+                with clients.line_api_call('multicast'):
+                    line_bot_api.multicast(recipients, message)
+            return len(recipients)
+        except LineBotApiError as e:
+            retryable = e.status_code == 429 or e.status_code >= 500
+            if not retryable or attempt == SEND_RETRIES:
+                raise
+            time.sleep(2 ** attempt)
+
+# 回傳成功人數與發送失敗的接收者
+def dispatch(sends):
+    limiter = RateLimiter(SEND_RATE_LIMIT)
+    sent = 0
+    failed = []
+    with ThreadPoolExecutor(max_workers=SEND_WORKERS) as executor:
+        futures = {executor.submit(_send, recipients, text, limiter): recipients for recipients, text in sends}
+        for future in as_completed(futures):
+            try:
+                sent += future.result()
+            except Exception as e:
+                failed += futures[future]
+                logging.error(f"發送提醒給 {len(futures[future])} 位用戶時發生錯誤：{str(e)}")
+    return sent, failed
+
+def send_reminders(reminder_time=None):
+    with REMINDER_RUN_SECONDS.time():
+        _send_reminders(reminder_time)
+
+def _send_reminders(reminder_time):
+    try:
+        # 只處理新跨過提醒門檻的食材，依擁有者分組
+        today = date.today()
+        claims = claim_notifications(get_due_notifications(today, reminder_time), today)
+        claims_by_owner = defaultdict(list)
+        for claim in claims:
+            claims_by_owner[claim[1]].append(claim)
+
+        if claims:
+            # 每個擁有者只收到自己的食材
+            digests = {owner_id: build_digest([(claim[2], claim[3]) for claim in owner_claims], today)
+                       for owner_id, owner_claims in claims_by_owner.items()}
+            sent, failed = dispatch(plan_sends(digests))
+            REMINDER_RECIPIENTS.inc('sent', amount=sent)
+            REMINDER_RECIPIENTS.inc('failed', amount=len(failed))
+            if failed:
+                release_notifications([claim for owner_id in failed for claim in claims_by_owner[owner_id]])
+            logging.info(f"已發送提醒給 {sent} 位用戶，失敗 {len(failed)} 位")
         else:
-            logging.info("沒有即將過期的食材。")
+            logging.info("沒有新到期的食材。")
     except Exception as e:
-        logging.error(f"發送提醒時發生錯誤：{str(e)}")
\ No newline at end of file
+        logging.error(f"發送提醒時發生錯誤：{str(e)}")
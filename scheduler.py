@@ -0,0 +1,202 @@
+import os
+import time
+import uuid
+import heapq
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+import db
+
+# 未自訂提醒時間的用戶使用預設時間（環境變數 REMINDER_TIME）
+DEFAULT_REMINDER_TIME = '16:03'
+# 只有持有租約的程序會發送提醒；租約過期後由其他程序接手
+LEASE_NAME = 'reminder-scheduler'
+LEASE_TTL = 60
+
+
+def default_reminder_time():
+    return os.getenv('REMINDER_TIME') or DEFAULT_REMINDER_TIME
+
+
+def normalize_reminder_time(text):
+    # 接受 H:MM 或 HH:MM，統一為 HH:MM；格式錯誤時拋出 ValueError
+    return datetime.strptime(text.strip(), '%H:%M').strftime('%H:%M')
+
+
+def previous_occurrence(reminder_time, now):
+    occurrence = datetime.combine(now.date(), datetime.strptime(reminder_time, '%H:%M').time())
+    if occurrence > now:
+        occurrence -= timedelta(days=1)
+    return occurrence
+
+
+def next_occurrence(reminder_time, now):
+    return previous_occurrence(reminder_time, now) + timedelta(days=1)
+
+
+@db.timed('get_reminder_times')
+def get_reminder_times():
+    rows = db.query_all('SELECT DISTINCT reminder_time FROM reminder_settings')
+    return {default_reminder_time()} | {row[0] for row in rows}
+
+
+@db.timed('set_reminder_time')
+def set_reminder_time(owner_id, reminder_time):
+    db.execute('''
+        INSERT INTO reminder_settings (owner_id, reminder_time) VALUES (?, ?)
+        ON CONFLICT(owner_id) DO UPDATE SET reminder_time = excluded.reminder_time
+    ''', (owner_id, reminder_time))
+
+
+def _job_name(reminder_time):
+    return f"reminder:{reminder_time}"
+
+
+@db.timed('get_last_run')
+def get_last_run(reminder_time):
+    row = db.query_one('SELECT last_run_at FROM scheduler_runs WHERE job = ?', (_job_name(reminder_time),))
+    return row[0] if row else None
+
+
+@db.timed('record_run')
+def record_run(reminder_time, run_at):
+    db.execute('''
+        INSERT INTO scheduler_runs (job, last_run_at) VALUES (?, ?)
+        ON CONFLICT(job) DO UPDATE SET last_run_at = excluded.last_run_at
+    ''', (_job_name(reminder_time), run_at))
+
+
+# 以 SQLite 中的一列作為租約，實現多個 worker 之間的單一領導者
+class Lease:
+    def __init__(self, name=LEASE_NAME, ttl=LEASE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    @db.timed('lease_acquire')
+    def acquire(self):
+        # 沒有人持有、租約已過期或本來就是自己持有時取得／續約
+        now = time.time()
+        with db.transaction() as conn:
+            row = conn.execute('SELECT holder, expires_at FROM leases WHERE name = ?', (self.name,)).fetchone()
+            if row is not None and row[0] != self.holder and row[1] > now:
+                return False
+            conn.execute('''
+                INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            ''', (self.name, self.holder, now + self.ttl))
+        return True
+
+    @db.timed('lease_release')
+    def release(self):
+        db.execute('DELETE FROM leases WHERE name = ? AND holder = ?', (self.name, self.holder))
+
+
+# 以最小堆積排列每個提醒時間的下一次執行時間，睡到最近的一個到期為止
+class ReminderScheduler:
+    def __init__(self, job, lease=None):
+        self.job = job
+        self.lease = lease or Lease()
+        self._heap = []
+        self._scheduled = set()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='reminder-scheduler', daemon=True)
+            self._thread.start()
+            logging.info("提醒排程器已啟動")
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.lease.release()
+        except Exception as e:
+            logging.error(f"釋放排程租約時發生錯誤：{str(e)}")
+
+    def reload(self):
+        # 提醒時間變更後立即喚醒排程器重新整理
+        with self._condition:
+            self._condition.notify()
+
+    def _refresh(self, now):
+        times = get_reminder_times()
+        for reminder_time in times - self._scheduled:
+            last_run = get_last_run(reminder_time)
+            if last_run is None:
+                # 第一次排程：記錄基準時間，之後的停機期間才能判斷是否漏跑
+                record_run(reminder_time, now.timestamp())
+                due_at = next_occurrence(reminder_time, now)
+            elif last_run < previous_occurrence(reminder_time, now).timestamp():
+                # 停機期間錯過的提醒立即補跑一次
+                logging.info(f"補發錯過的提醒：{reminder_time}")
+                due_at = now
+            else:
+                due_at = next_occurrence(reminder_time, now)
+            heapq.heappush(self._heap, (due_at, reminder_time))
+            self._scheduled.add(reminder_time)
+        return times
+
+    def _run_due(self, now, times):
+        while self._heap and self._heap[0][0] <= now:
+            due_at, reminder_time = heapq.heappop(self._heap)
+            if reminder_time not in times:
+                # 已沒有用戶使用這個提醒時間
+                self._scheduled.discard(reminder_time)
+                continue
+            logging.info(f"執行提醒排程：{reminder_time}")
+            # 開始前先記錄本次執行，其他程序接手時不會再補跑同一次提醒；
+            # 中途失敗而未送出的食材 notify_on 仍小於等於今天，下一次執行時會再送出
+            record_run(reminder_time, time.time())
+            self._run_job(reminder_time)
+            heapq.heappush(self._heap, (next_occurrence(reminder_time, datetime.now()), reminder_time))
+
+    def _run_job(self, reminder_time):
+        # 發送可能因速率限制與重試超過租約時間，執行期間由背景執行緒持續續約
+        done = threading.Event()
+
+        def heartbeat():
+            while not done.wait(self.lease.ttl / 3):
+                try:
+                    if not self.lease.acquire():
+                        logging.error(f"提醒執行期間失去排程租約：{reminder_time}")
+                except Exception as e:
+                    logging.error(f"續約排程租約時發生錯誤：{str(e)}")
+
+        thread = threading.Thread(target=heartbeat, name='reminder-lease-heartbeat', daemon=True)
+        thread.start()
+        try:
+            self.job(reminder_time)
+        finally:
+            done.set()
+            thread.join()
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                if self.lease.acquire():
+                    now = datetime.now()
+                    times = self._refresh(now)
+                    self._run_due(now, times)
+                    # 睡到下一個提醒到期，但不超過租約續約間隔
+                    timeout = self.lease.ttl / 3
+                    if self._heap:
+                        timeout = min(timeout, max(0, (self._heap[0][0] - datetime.now()).total_seconds()))
+                else:
+                    # 不是領導者：清空排程，接手時重新計算並補跑
+                    self._heap = []
+                    self._scheduled = set()
+                    timeout = self.lease.ttl / 2
+            except Exception as e:
+                logging.error(f"提醒排程發生錯誤：{str(e)}")
+                timeout = self.lease.ttl / 3
+            with self._condition:
+                if not self._stopped:
+                    self._condition.wait(timeout)
@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import logging
+import db
+from expiring_map import ExpiringMap, SweepCounter
+
+# 閒置超過 SESSION_TTL 秒的對話狀態會被清除
+DEFAULT_TTL = 30 * 60
+# 記憶體後端最多使用的位元組數
+DEFAULT_MEMORY_LIMIT = 16 * 1024 * 1024
+# SQLite 後端最多保留的對話數
+DEFAULT_MAX_ROWS = 100000
+# SQLite 後端每寫入幾次就清理一次過期資料
+SWEEP_INTERVAL = 200
+
+
+def new_session(owner_id=None):
+    return {"state": None, "data": {}, "view": None, "page": None, "owner": owner_id}
+
+
+# 只序列化非空欄位，使用緊湊的 JSON 格式
+def encode(session):
+    return json.dumps({key: value for key, value in session.items() if value}, ensure_ascii=False, separators=(',', ':'))
+
+
+def decode(text):
+    session = new_session()
+    session.update(json.loads(text))
+    return session
+
+
+# 單一程序內的對話狀態：依最後使用時間排序，超過閒置時間或記憶體上限時淘汰最舊的
+class MemorySessionStore:
+    def __init__(self, ttl=DEFAULT_TTL, memory_limit=DEFAULT_MEMORY_LIMIT):
+        self.ttl = ttl
+        self.memory_limit = memory_limit
+        # 以序列化後的長度計算記憶體用量
+        self._records = ExpiringMap(ttl, memory_limit, weight=len)
+
+    def get(self, session_id):
+        record = self._records.get(session_id, time.time(), touch=True)
+        return decode(record) if record is not None else None
+
+    def set(self, session_id, session):
+        self._records.put(session_id, encode(session), time.time())
+
+    def delete(self, session_id):
+        self._records.pop(session_id)
+
+    def __len__(self):
+        return len(self._records)
+
+
+# 多個程序共用的對話狀態，存放在同一個 SQLite 資料庫
+class SQLiteSessionStore:
+    def __init__(self, ttl=DEFAULT_TTL, max_rows=DEFAULT_MAX_ROWS):
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._sweeper = SweepCounter(SWEEP_INTERVAL, self.sweep)
+
+    @db.timed('get_session')
+    def get(self, session_id):
+        row = db.query_one('SELECT record FROM sessions WHERE session_id = ? AND updated_at > ?', (session_id, time.time() - self.ttl))
+        return decode(row[0]) if row else None
+
+    @db.timed('set_session')
+    def set(self, session_id, session):
+        db.execute('''
+            INSERT INTO sessions (session_id, record, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(session_id) DO UPDATE SET record = excluded.record, updated_at = excluded.updated_at
+        ''', (session_id, encode(session), time.time()))
+        self._sweeper.tick()
+
+    @db.timed('delete_session')
+    def delete(self, session_id):
+        db.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+
+    @db.timed('sweep_sessions')
+    def sweep(self):
+        try:
+            with db.transaction() as conn:
+                conn.execute('DELETE FROM sessions WHERE updated_at <= ?', (time.time() - self.ttl,))
+                conn.execute('''
+                    DELETE FROM sessions WHERE session_id IN (
+                        SELECT session_id FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?
+                    )
+                ''', (self.max_rows,))
+        except Exception as e:
+            logging.error(f"清理對話狀態時發生錯誤：{str(e)}")
+
+
+# 依環境變數 SESSION_BACKEND（memory 或 sqlite）建立對話狀態儲存
+def create_session_store():
+    backend = (os.getenv('SESSION_BACKEND') or 'memory').lower()
+    ttl = int(os.getenv('SESSION_TTL') or DEFAULT_TTL)
+    if backend == 'sqlite':
+        return SQLiteSessionStore(ttl=ttl, max_rows=int(os.getenv('SESSION_MAX_ROWS') or DEFAULT_MAX_ROWS))
+    return MemorySessionStore(ttl=ttl, memory_limit=int(os.getenv('SESSION_MEMORY_LIMIT') or DEFAULT_MEMORY_LIMIT))
@@ -0,0 +1,96 @@
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+# 在全新的子程序中匯入 finalproject 並建立應用，量測冷啟動時間
+PROFILE_SCRIPT = '''
+import sys
+import time
+start = time.perf_counter()
+import finalproject
+imported = time.perf_counter()
+finalproject.create_app(sys.argv[1])
+created = time.perf_counter()
+print(f"STARTUP {(imported - start) * 1000:.3f} {(created - imported) * 1000:.3f}")
+'''
+
+
+# 解析 python -X importtime 的輸出：「import time: self [us] | cumulative | 模組」
+def parse_importtime(stderr):
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+    return modules
+
+
+# -X importtime 先列出子模組再列出父模組：finalproject 之前、上一個 depth 0 之後的 depth 1 即為它直接匯入的模組；
+# finalproject 之後的 depth 0 是 create_app() 執行時才匯入的模組
+def project_imports(modules, root='finalproject'):
+    children = []
+    for index, module in enumerate(modules):
+        if module["depth"] == 1:
+            children.append(module)
+        elif module["depth"] == 0:
+            if module["module"] == root:
+                return children + [m for m in modules[index + 1:] if m["depth"] == 0]
+            children = []
+    return []
+
+
+def profile_startup(top=15):
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp:
+        # 量測時不啟動提醒排程器
+        env = dict(os.environ, RUN_SCHEDULER='0')
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', PROFILE_SCRIPT, os.path.join(tmp, 'profile.db')],
+            cwd=project_dir, capture_output=True, text=True, env=env,
+        )
+    if result.returncode != 0:
+        raise RuntimeError(f"啟動失敗：\n{result.stderr[-2000:]}")
+    import_ms, create_app_ms = next(
+        map(float, line.split()[1:]) for line in result.stdout.splitlines() if line.startswith('STARTUP ')
+    )
+    modules = parse_importtime(result.stderr)
+    return {
+        "import_ms": import_ms,
+        "create_app_ms": create_app_ms,
+        "total_ms": import_ms + create_app_ms,
+        # 列出 finalproject 直接匯入（depth 1）與 create_app() 延遲匯入的模組中最耗時的
+        "top_imports": sorted(project_imports(modules), key=lambda m: m["cumulative_ms"], reverse=True)[:top],
+    }
+
+
+def format_report(report):
+    lines = [
+        f"匯入 finalproject：{report['import_ms']:.1f} ms",
+        f"create_app()：{report['create_app_ms']:.1f} ms",
+        f"合計：{report['total_ms']:.1f} ms",
+        "最耗時的匯入：",
+    ]
+    lines += [f"  {m['cumulative_ms']:8.1f} ms  {m['module']}" for m in report["top_imports"]]
+    return "\n".join(lines)
+
+
+# CLI 子命令：輸出報告，可寫入 JSON 供比較，超過預算時以非零狀態結束
+def run(args):
+    report = profile_startup(top=args.top)
+    print(format_report(report))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    budget = args.budget_ms or float(os.getenv('STARTUP_BUDGET_MS') or 0)
+    if budget and report["total_ms"] > budget:
+        print(f"超出冷啟動預算：{report['total_ms']:.1f} ms > {budget:.1f} ms")
+        return 1
+    return 0
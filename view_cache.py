@@ -0,0 +1,62 @@
+import os
+import threading
+from collections import OrderedDict
+import db
+
+# 已渲染的食材列表快取，最多保留的頁數
+VIEW_CACHE_SIZE = int(os.getenv('VIEW_CACHE_SIZE') or 1024)
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+# 每個擁有者的庫存版本：寫入時在同一個交易中遞增，讀取只需一次主鍵查詢
+@db.timed('get_inventory_version')
+def get_version(owner_id):
+    row = db.query_one('SELECT version FROM inventory_versions WHERE owner_id = ?', (owner_id,))
+    return row[0] if row else 0
+
+
+def bump_version(conn, owner_id):
+    # 回傳新的版本，供記憶體中的索引判斷是否可以逐筆更新
+    conn.execute('''
+        INSERT INTO inventory_versions (owner_id, version) VALUES (?, 1)
+        ON CONFLICT(owner_id) DO UPDATE SET version = version + 1
+    ''', (owner_id,))
+    return conn.execute('SELECT version FROM inventory_versions WHERE owner_id = ?', (owner_id,)).fetchone()[0]
+
+
+# 版本不同表示庫存已變更，視為未命中
+def get(key, version):
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == version:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return entry[1]
+        if entry is not None:
+            del _cache[key]
+        _stats["misses"] += 1
+    return None
+
+
+def put(key, version, value):
+    with _lock:
+        _cache[key] = (version, value)
+        _cache.move_to_end(key)
+        while len(_cache) > VIEW_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def stats():
+    with _lock:
+        result = dict(_stats)
+        result["size"] = len(_cache)
+    return result
+
+
+@db.on_configure
+def clear():
+    with _lock:
+        _cache.clear()
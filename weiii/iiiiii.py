@@ -63,14 +63,16 @@ def handle_message(event):
         user_states[user_id] = {"state": "add_name", "data": {}}
         reply = "請告訴我要新增的食材名稱和有效日期（格式：名稱1,日期1;名稱2,日期2）："
     elif user_message == "查詢":
-        user_states[user_id] = {"state": None, "data": {}}
         ingredients = get_all_ingredients()
+        # 記錄顯示編號對應的實際 ID，刪除時不必重新編號
+        user_states[user_id] = {"state": None, "data": {"view": [row[0] for row in ingredients]}}
         if ingredients:
             reply = "\n".join([f"{index + 1}. {row[1]} (有效日期: {row[2]})" for index, row in enumerate(ingredients)])
         else:
             reply = "目前沒有任何食材記錄。"
     elif user_message == "刪除":
-        user_states[user_id] = {"state": "delete", "data": {}}
+        view = user_states[user_id]["data"].get("view") or [row[0] for row in get_all_ingredients()]
+        user_states[user_id] = {"state": "delete", "data": {"view": view}}
         reply = "請輸入要刪除的食材 ID（多個 ID 請用空白分隔）："
     
     # 如果訊息不是新增、查詢或刪除，則進行與 Google Generative AI 的對話
@@ -95,9 +97,9 @@ def handle_message(event):
             user_states[user_id] = {"state": None, "data": {}}
         elif state == "delete":
             try:
+                view = user_states[user_id]["data"]["view"]
                 ingredient_ids = [int(id.strip()) for id in user_message.split()]
-                delete_ingredients(ingredient_ids)
-                reindex_ingredients()
+                delete_ingredients([view[i - 1] for i in ingredient_ids if 1 <= i <= len(view)])
                 reply = f"已成功刪除食材 ID：{' '.join(map(str, ingredient_ids))}"
             except ValueError:
                 reply = "請輸入有效的食材 ID。"
@@ -146,16 +148,5 @@ def delete_ingredients(ids):
     conn.commit()
     conn.close()
 
-def reindex_ingredients():
-    conn = sqlite3.connect('ingredients.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM ingredients ORDER BY id')
-    rows = cursor.fetchall()
-    cursor.execute('DELETE FROM ingredients')
-    for index, row in enumerate(rows, start=1):
-        cursor.execute('INSERT INTO ingredients (id, name, expiration_date) VALUES (?, ?, ?)', (index, row[1], row[2]))
-    conn.commit()
-    conn.close()
-
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)